@@ -11,13 +11,21 @@ Created on Tue May  4 07:44:54 2021
 
 import pandas as pd
 import numpy as np
-import sys
-from scipy.optimize import curve_fit, fsolve
-from scipy import stats
+from scipy.optimize import curve_fit
 from pathlib import Path
+import glob
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from importlib.util import find_spec
 import re
+import matplotlib
 import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
+from matplotlib.collections import LineCollection, PolyCollection
+from matplotlib.lines import Line2D
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, Side
 import warnings
 warnings.filterwarnings(action = 'ignore')
 
@@ -38,11 +46,414 @@ RATES = np.array([0.01, 0.05, 0.1, 0.2, 1/3, 0.5, 1, 2, 2.5, 5, 10, 20, 40, 80,
 COLUMNS = ['Time', 'Cycle', 'Step', 'Current', 'Potential', 'Capacity', 'Prot_step']
 UNITS = ['(h)', None, None, '(mA)', '(V)', '(mAh)', None]
 
+BIOCOLUMNS = ['mode', 'time/s', 'I/mA', 'Ewe-Ece/V', 'Ewe/V', '(Q-Qo)/mA.h', 'Ns']
+BIODTYPES = {'mode': np.int8, 'Ns': np.int32}
+BIOHEADER = re.compile(r'Loaded Setting File : (?P<prot>.+)'
+                       r'|Mass of active material : (?P<mass>\d+.?\d+) (?P<massUnit>.+)'
+                       r'|Battery capacity : (?P<capacity>\d+.?\d+) (?P<capacityUnit>.+)'
+                       r'|Technique started on : (?P<start>.+)')
+UHPCHEADER = re.compile(r'Cell: (?P<cell>[^,\n]+)'
+                        r'|Mass\s+\((?P<massUnit>[^)]+)\):\s+(?P<mass>\d*\.\d+)'
+                        r'|Capacity\s+\((?P<capacityUnit>[^)]+)\):\s+(?P<capacity>\d*\.\d+)')
+
 SHAPES = ['sphere']
 
+# Bin-averaged columns in export order, and those drawn by _errorbar_binned
+BINNEDEXPORT = ['Voltage (V)', 'Voltage STD', 'SOC', 'SOC STD', 'Dc (cm^2/s)', 'Dc geoSTD', 'Dt* (cm^2/s)', 'Dt* geoSTD', 'dq/dV (mAh/gV)', 'dq/dV STD',
+                'Rfit (Ohm)', 'Rfit geoSTD', 'micR (Ohmcm^2)', 'micR geoSTD', 'Rdrop (Ohm)', 'Rdrop geoSTD', 'Cap Span', 'Cap Span STD', 'Fit Error', 'Fit Error STD']
+BINNEDCOLUMNS = ['Voltage (V)', 'SOC', 'Dc (cm^2/s)', 'Dc geoSTD', 'Dt* (cm^2/s)', 'Dt* geoSTD', 'micR (Ohmcm^2)', 'micR geoSTD', 'dq/dV (mAh/gV)', 'dq/dV STD']
+
+VIRIDIS = matplotlib.colormaps['viridis']
+LOGSUBS = np.arange(1.0, 10.0) * 0.1
+
+# Use pyarrow's multithreaded csv parser when it is installed
+CSV_ENGINE = 'pyarrow' if find_spec('pyarrow') is not None else 'c'
+
+# Also keep a parquet copy of bin-averaged results for MATCOMPARE when pyarrow is installed
+PARQUET = find_spec('pyarrow') is not None
+
+def _probe_header(f):
+
+    # Read beginning of file to discover lines in header
+    f.readline()
+    return int(f.readline().strip().split()[-1])
+
+def _read_biologic(fileLoc, cols):
+
+    with open(fileLoc, 'r', encoding = 'latin-1', buffering = 1 << 20) as f:
+        hlinenum = _probe_header(f) - 1
+
+        # Read file into dataframe from the same handle
+        f.seek(0)
+        dfTemp = pd.read_csv(f, skiprows = hlinenum, sep = '\t', usecols = cols, dtype = BIODTYPES, engine = 'c')
+
+    return dfTemp[cols]
+
+def _read_biologic_files(path, files, cols):
+
+    # Read files on parallel threads since parsing is mostly I/O and GIL-free C
+    with ThreadPoolExecutor(max_workers = min(8, len(files))) as executor:
+        return list(executor.map(lambda file: _read_biologic(Path(path) / file, cols), files))
+
+def _log_locators(axis):
+
+    # Decade major ticks with minor ticks at every integer multiple. Locators bind to a single axis, so build a new pair per axis.
+    axis.set_minor_locator(ticker.LogLocator(subs = LOGSUBS, numticks = 10))
+    axis.set_major_locator(ticker.LogLocator(numticks = 10))
+
+def _binned_figure():
+
+    # 3 x 2 panels of D and micR (log rows) and dq/dV against voltage (left) and decreasing ion saturation (right), stacked without gaps.
+    # Rows share y and columns share x, so ticks are set once per row or column. Plot into them with plot/errorbar; semilogy would reset the log locators.
+    fig, axs = plt.subplots(ncols = 2, nrows = 3, figsize = (6, 7.5), sharex = 'col', sharey = 'row',
+    gridspec_kw = {'height_ratios': [2, 2, 1], 'hspace': 0.0, 'width_ratios': [1, 1], 'wspace': 0.0})
+    axs[0, 0].set_yscale('log')
+    axs[1, 0].set_yscale('log')
+    axs[0, 0].set_ylabel('$D$ (cm$\mathregular{^{2}}$ s$\mathregular{^{-1}}$)')
+    axs[1, 0].set_ylabel('Max $ρ_{c}$ (Ω cm$\mathregular{^{2}}$)')
+    axs[2, 0].set_ylabel('$dq/dV$\n(mAh g$\mathregular{^{-1}}$ V$\mathregular{^{-1}}$)')
+    axs[2, 0].set_xlabel('Voltage (V)')
+    axs[2, 1].set_xlabel('Ion Saturation')
+    axs[0, 1].invert_xaxis()
+    axs[0, 0].xaxis.set_minor_locator(ticker.AutoMinorLocator())
+    _log_locators(axs[0, 0].yaxis)
+    axs[0, 1].xaxis.set_minor_locator(ticker.AutoMinorLocator())
+    _log_locators(axs[1, 0].yaxis)
+    axs[2, 0].yaxis.set_minor_locator(ticker.AutoMinorLocator())
+    for ax in axs.flat:
+        ax.grid(which = 'minor', color = 'lightgrey')
+    return fig, axs
+
+def _span_boxes(x, halfwidth, lo, hi):
+
+    # Rectangle vertices spanning lo to hi around every x, for drawing as one PolyCollection
+    x = np.asarray(x, dtype = float)[:, None] + np.asarray(halfwidth, dtype = float).reshape(-1, 1)*np.array([-1, -1, 1, 1])
+    y = np.column_stack([lo, hi, hi, lo])
+    return np.stack([x, y], axis = -1)
+
+def _errorbar_binned(axs, df, color):
+
+    # Bin-averaged D and micR with geometric error bars and dq/dV with arithmetic ones, against voltage (left) and SOC (right)
+    yerrDc = [df['Dc (cm^2/s)']*(1 - 1/df['Dc geoSTD']), df['Dc (cm^2/s)']*(df['Dc geoSTD'] - 1)]
+    yerrDt = [df['Dt* (cm^2/s)']*(1 - 1/df['Dt* geoSTD']), df['Dt* (cm^2/s)']*(df['Dt* geoSTD'] - 1)]
+    yerrmicR = [df['micR (Ohmcm^2)']*(1 - 1/df['micR geoSTD']), df['micR (Ohmcm^2)']*(df['micR geoSTD'] - 1)]
+    for col, x in enumerate([df['Voltage (V)'], df['SOC']]):
+        axs[0, col].errorbar(x, df['Dc (cm^2/s)'], yerr = yerrDc, fmt = '-', color = color)
+        axs[0, col].errorbar(x, df['Dt* (cm^2/s)'], yerr = yerrDt, fmt = ':', color = color, elinewidth = 0.5, markeredgewidth = 0.5)
+        axs[1, col].errorbar(x, df['micR (Ohmcm^2)'], yerr = yerrmicR, fmt = '-', color = color)
+        axs[2, col].errorbar(x, df['dq/dV (mAh/gV)'], yerr = df['dq/dV STD'], fmt = '-', color = color)
+
+def _decimate(x, y, n = 4000):
+
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if len(y) <= n:
+        return x, y
+
+    # Keep the min and max point of each bucket in order so the drawn line envelope is unchanged
+    bucket = int(np.ceil(2*len(y)/n))
+    nBuckets = int(np.ceil(len(y)/bucket))
+    yPad = np.full(nBuckets*bucket, np.nan)
+    yPad[:len(y)] = y
+    yPad = yPad.reshape(nBuckets, bucket)
+    offsets = bucket*np.arange(nBuckets)
+    inds = np.unique(np.r_[0, offsets + np.nanargmin(yPad, axis = 1), offsets + np.nanargmax(yPad, axis = 1), len(y) - 1])
+
+    return x[inds], y[inds]
+
+def _segment_pulses(modeSteps, starts):
+
+    modeSteps = modeSteps.copy()
+    keep = np.ones(starts[-1], dtype = bool)
+    ocvRanges = []
+    pulseInds = []
+    blockStarts = []
+    blockLens = []
+    unfinishedStep = len(modeSteps)
+
+    # Iterate over each pulse starting with their preceeding OCV V rest step
+    for i in range(len(modeSteps)):
+        if i != len(modeSteps) - 1:
+            if modeSteps[i] == 0 and modeSteps[i+1] != 0:
+
+                # Average together all points of the rest step before a pulse into 1 point (OCV V)
+                ocvRanges.append((starts[i], starts[i+1]))
+                pulseInds.append(starts[i+1])
+                keep[starts[i] + 1:starts[i+1]] = False
+
+                # Determine nAvg, the number of datapoints to average together so that there are 10 points in the first step
+                nAvg = max(int((starts[i+2] - starts[i+1])/10), 1)
+
+                # Iterate over each CC step in pulse
+                j = 1
+                while modeSteps[i+j] != 0:
+                    pulseInd = starts[i+j]
+                    nextStepInd = starts[i+j+1]
+
+                    # Keep first point in pulse (given OCV V) else remove first point in CC step
+                    if j != 1:
+                        keep[pulseInd] = False
+
+                    # Keep one averaged datapoint per set of nAvg datapoints skipping the first and remainder datapoints
+                    nBlocks = (nextStepInd - pulseInd - 1)//nAvg
+                    stepBlockStarts = pulseInd + 1 + nAvg*np.arange(nBlocks)
+                    keep[pulseInd + 1:nextStepInd] = False
+                    keep[stepBlockStarts] = True
+                    blockStarts.append(stepBlockStarts)
+                    blockLens.append(np.full(nBlocks, nAvg))
+
+                    j = j + 1
+        else:
+
+            # Calculate OCV V for end of final pulse
+            if modeSteps[i] == 0 and modeSteps[i-1] == 0 and modeSteps[i-2] == 0 and modeSteps[i-3] == 1:
+                ocvRanges.append((starts[i], starts[i+1]))
+                keep[starts[i] + 1:starts[i+1]] = False
+
+            # Label steps after last OCV V as CC to prevent analysis (Test stopped prematurely)
+            else:
+                while unfinishedStep > 0 and modeSteps[unfinishedStep - 1] == 0:
+                    unfinishedStep = unfinishedStep - 1
+                    modeSteps[unfinishedStep] = 1
+
+    # Final OCV V (if any) is last so ocvRanges[:len(pulseInds)] pair with pulseInds
+    ocvRanges = np.array(ocvRanges, dtype = np.int64).reshape(-1, 2)
+    pulseInds = np.array(pulseInds, dtype = np.int64)
+    blockStarts = np.concatenate(blockStarts) if blockStarts else np.zeros(0, dtype = np.int64)
+    blockLens = np.concatenate(blockLens) if blockLens else np.zeros(0, dtype = np.int64)
+
+    return modeSteps, keep, ocvRanges, pulseInds, blockStarts, blockLens, unfinishedStep
+
+def _average_pulses(dfTemp, file):
+
+    # Find the first index and mode of each step from runs of Ns
+    ns = dfTemp['Ns'].to_numpy()
+    starts = np.flatnonzero(np.r_[True, ns[1:] != ns[:-1]])
+    modeSteps = dfTemp['mode'].to_numpy()[starts]
+
+    # Detect if test ended prematurely
+    unfinished = modeSteps[-1] != 0
+
+    # Extract data once as [mode, time, I, Ewe-Ece, Ewe, Q, Ns] leaving room for a dummy step if unfinished
+    cols = dfTemp.columns
+    A = np.empty((len(dfTemp) + unfinished, len(cols)), order = 'F')
+    for k, col in enumerate(cols):
+        A[:len(dfTemp), k] = dfTemp[col].to_numpy()
+
+    # Add dummy step at end to prevent overindexing
+    if unfinished:
+        A[-1] = A[-2]
+        A[-1, 0] = 0
+        A[-1, 6] = A[-1, 6] + 1
+        starts = np.r_[starts, len(A) - 1]
+        modeSteps = np.r_[modeSteps, 0]
+    starts = np.r_[starts, len(A)]
+
+    # Locate OCV V rest steps, CC averaging sets, and datapoints to keep
+    modeSteps, keep, ocvRanges, pulseInds, blockStarts, blockLens, unfinishedStep = _segment_pulses(modeSteps, starts)
+
+    # Average together all points of each OCV V rest step and give OCV V to first point in pulse
+    if len(ocvRanges):
+        ocvBounds = ocvRanges.ravel()
+        ocvBounds = ocvBounds[ocvBounds < len(A)]
+        A[ocvRanges[:, 0]] = np.add.reduceat(A, ocvBounds, axis = 0)[::2]/np.diff(ocvRanges, axis = 1)
+    A[pulseInds, 3:5] = A[ocvRanges[:len(pulseInds), 0], 3:5]
+
+    # Average together each set of nAvg datapoints within CC steps
+    if len(blockStarts):
+        blockBounds = np.column_stack((blockStarts, blockStarts + blockLens)).ravel()
+        A[blockStarts, 1:6] = np.add.reduceat(A[:, 1:6], blockBounds, axis = 0)[::2]/blockLens[:, None]
+
+    # Label steps after last OCV V as CC to prevent analysis (Test stopped prematurely)
+    if unfinishedStep != len(modeSteps):
+        print(file, 'ended prematurely. Labelling last pulse as unfinished to prevent analysis.')
+        A[starts[unfinishedStep]:, 0] = 1
+
+    # Remove initial rest step series
+    firstStep = np.argmax(modeSteps != 0)
+    keep[:starts[firstStep]] = False
+    nsSteps = A[starts[:-1], 6]
+
+    # Combine all rest steps in a series except for the last step into 1 step
+    for i in range(firstStep + 1, len(modeSteps) - 1):
+        if modeSteps[i] == 0 and modeSteps[i-1] == 0 and modeSteps[i+1] == 0:
+            nsSteps[i] = nsSteps[i-1]
+
+    # Combine all CC steps in a series
+    for i in range(firstStep + 1, len(modeSteps)):
+        if modeSteps[i] != 0 and modeSteps[i-1] != 0:
+            nsSteps[i] = nsSteps[i-1]
+
+    # Apply combined step numbers to all datapoints using the length of each step
+    A[:, 6] = np.repeat(nsSteps, np.diff(starts))
+
+    # Label last step as rest step if not already (Test stopped prematurely)
+    A[np.flatnonzero(keep)[-1], 0] = 0
+
+    # Rebuild dataframe from kept datapoints
+    dfTemp = pd.DataFrame(A[keep], columns = cols).astype(BIODTYPES)
+
+    # Relabel steps with continuous integers starting from 1
+    ns = dfTemp['Ns'].to_numpy()
+    dfTemp['Ns'] = np.cumsum(np.r_[True, ns[1:] != ns[:-1]], dtype = np.int32)
+
+    return dfTemp
+
+def _nearest_index(values, x):
+
+    # values is sorted so the nearest one is a neighbour of the insertion point (lower one on ties)
+    i = np.clip(np.searchsorted(values, x), 1, len(values) - 1)
+    return i - (x - values[i-1] <= values[i] - x)
+
+def _nearest_rate(rate):
+
+    return RATES[_nearest_index(RATES, rate)]
+
+def _pulse_stats(pulsecaps, pulsevolts, currents, cvoltind):
+
+    # determine dqdv based on the measurements before the voltage cutoff
+    diffq = (pulsecaps[cvoltind-2] - pulsecaps[cvoltind-1]) / (pulsevolts[cvoltind-2] - pulsevolts[cvoltind-1])
+
+    return (pulsecaps[0], pulsecaps[cvoltind], pulsevolts[0], pulsevolts[cvoltind],
+            currents.mean(), abs(pulsevolts[0] - pulsevolts[1]), diffq)
+
+@lru_cache(maxsize = 8)
+def _sphere_alphas(nalpha):
+
+    # Roots of tan(a) = a by Newton steps on sin(a) - a*cos(a) from the asymptote (n + 1/2)*pi - 1/((n + 1/2)*pi)
+    a = (np.arange(1, nalpha+1) + 0.5)*np.pi
+    a = a - 1/a
+    for it in range(50):
+        step = (np.sin(a) - a*np.cos(a))/(a*np.sin(a))
+        a = a - step
+        if np.all(np.absolute(step) < 1e-13*a):
+            break
+    
+    alphas = np.around(a, 8)**2
+    alphas.flags.writeable = False
+    return alphas
+
+def _exp_table(k, alphas):
+
+    # exp(-alpha*k) for every k down the rows and alpha along the columns, built in a single buffer
+    E = np.multiply.outer(k, -alphas)
+    return np.exp(E, out = E)
+
+def _atlung_tau(Q_arr, alphas, A, B, P = 0.0, block = 256):
+
+    # Solve the Atlung equation for tau at every Q where P < Q (tau = 0 elsewhere) with Newton steps on blocks of Q.
+    # The residual is increasing and concave in tau with its root below 1, so iterates clamped to [0, 1] converge.
+    tau = np.zeros(len(Q_arr))
+    inv_alphas = 1/alphas
+    solve = np.flatnonzero(P < Q_arr)
+    for start in range(0, len(solve), block):
+        rows = solve[start:start+block]
+        Q = Q_arr[rows]
+        AQ = A*Q
+        PQ = P/Q
+        t = np.full(len(rows), 0.5)
+        for it in range(100):
+            E = _exp_table(t*Q, alphas)
+            f = t - 1 + (1/B - 2*(E @ inv_alphas))/AQ + PQ
+            tnew = np.clip(t - f/(1 + (2/A)*E.sum(axis = 1)), 0, 1)
+            converged = np.all(np.absolute(tnew - t) <= 1e-14)
+            t = tnew
+            if converged:
+                break
+        tau[rows] = t
+    
+    return tau
+
+@lru_cache(maxsize = 8)
+def _shape_constants(shape, nalpha):
+
+    # Eigenvalues and Atlung constants A, B for the particle shape
+    if shape == 'sphere':
+        return _sphere_alphas(nalpha), 3, 5
+    
+    alphas = (np.arange(1, nalpha+1)*np.pi)**2
+    alphas.flags.writeable = False
+    return alphas, 1, 3
+
+@lru_cache(maxsize = 128)
+def _atlung_curve(shape, nalpha, nQ, logQmin, P = 0.0):
+
+    # Model tau vs Q curve, shared by every fit (and every cell) with the same shape, resolution and P
+    alphas, A, B = _shape_constants(shape, nalpha)
+    Q_arr = np.logspace(logQmin, 2, nQ)
+    tau_sol = _atlung_tau(Q_arr, alphas, A, B, P = P)
+    Q_arr.flags.writeable = False
+    tau_sol.flags.writeable = False
+    return Q_arr, tau_sol
+
+def _bin_stats(df, centers, binsize):
+
+    # Bin of every point by voltage and by initial voltage (-1 when outside all bins)
+    lo = centers - binsize/2
+    hi = centers + binsize/2
+    def binof(volts):
+        k = np.searchsorted(lo, volts, side = 'right') - 1
+        return np.where((k >= 0) & (volts < hi[k]), k, -1)
+    vbin = binof(df['Voltage (V)'].to_numpy(dtype = float))
+    ibin = binof(df['Initial Voltage (V)'].to_numpy(dtype = float))
+    bins = range(len(centers))
+    
+    # Geometric mean and standard deviation for diffusivities (by voltage) and resistances (by initial voltage)
+    logD = np.log(df[['Dc (cm^2/s)', 'Dt* (cm^2/s)']].astype(float)).groupby(vbin)
+    logR = np.log(df[['Rfit (Ohm)', 'micR (Ohmcm^2)', 'Rdrop (Ohm)']].astype(float)).groupby(ibin)
+    geoMean = pd.concat([np.exp(logD.mean()), np.exp(logR.mean())], axis = 1).reindex(bins)
+    geoSTD = pd.concat([np.exp(logD.std()), np.exp(logR.std())], axis = 1).reindex(bins)
+    
+    # Arithmetic mean and standard deviation for all else. Voltage and SOC count each point in its voltage bin and, if different, its initial voltage bin
+    both = pd.concat([df[['Voltage (V)', 'SOC']]]*2, ignore_index = True).astype(float).groupby(np.r_[vbin, np.where(ibin != vbin, ibin, -1)])
+    bothMean = both.mean().reindex(bins)
+    bothSTD = both.std().reindex(bins)
+    other = df[['dq/dV (mAh/gV)', 'Cap Span', 'Fit Error']].astype(float).groupby(vbin)
+    otherMean = other.mean().reindex(bins)
+    otherSTD = other.std().reindex(bins)
+    
+    return pd.DataFrame({'Voltage (V)': centers,
+                         'Dc (cm^2/s)': geoMean['Dc (cm^2/s)'].to_numpy(), 'Dc geoSTD': geoSTD['Dc (cm^2/s)'].to_numpy(),
+                         'Dt* (cm^2/s)': geoMean['Dt* (cm^2/s)'].to_numpy(), 'Dt* geoSTD': geoSTD['Dt* (cm^2/s)'].to_numpy(),
+                         'Rfit (Ohm)': geoMean['Rfit (Ohm)'].to_numpy(), 'Rfit geoSTD': geoSTD['Rfit (Ohm)'].to_numpy(),
+                         'micR (Ohmcm^2)': geoMean['micR (Ohmcm^2)'].to_numpy(), 'micR geoSTD': geoSTD['micR (Ohmcm^2)'].to_numpy(),
+                         'Rdrop (Ohm)': geoMean['Rdrop (Ohm)'].to_numpy(), 'Rdrop geoSTD': geoSTD['Rdrop (Ohm)'].to_numpy(),
+                         'Voltage STD': bothSTD['Voltage (V)'].to_numpy(),
+                         'SOC': bothMean['SOC'].to_numpy(), 'SOC STD': bothSTD['SOC'].to_numpy(),
+                         'dq/dV (mAh/gV)': otherMean['dq/dV (mAh/gV)'].to_numpy(), 'dq/dV STD': otherSTD['dq/dV (mAh/gV)'].to_numpy(),
+                         'Cap Span': otherMean['Cap Span'].to_numpy(), 'Cap Span STD': otherSTD['Cap Span'].to_numpy(),
+                         'Fit Error': otherMean['Fit Error'].to_numpy(), 'Fit Error STD': otherSTD['Fit Error'].to_numpy()})
+
+def _write_sheets(filepath, sheets):
+
+    # Stream (name, dataframe) pairs into a write-only workbook, one sheet each, with the same bold boxed header as to_excel,
+    # blank cells for NaN and 'inf'/'-inf' text for infinities (openpyxl would leave those blank too; read_excel parses the text back to float)
+    thin = Side(style = 'thin')
+    wb = Workbook(write_only = True)
+    for name, frame in sheets:
+        ws = wb.create_sheet(name)
+        header = []
+        for col in frame.columns:
+            cell = WriteOnlyCell(ws, value = col)
+            cell.font = Font(bold = True)
+            cell.border = Border(left = thin, right = thin, top = thin, bottom = thin)
+            cell.alignment = Alignment(horizontal = 'center', vertical = 'top')
+            header.append(cell)
+        ws.append(header)
+        cells = frame.astype(object).where(frame.notna(), None).mask(frame.isin([np.inf]), 'inf').mask(frame.isin([-np.inf]), '-inf')
+        for row in cells.itertuples(index = False, name = None):
+            ws.append(row)
+    wb.save(filepath)
+
+@lru_cache(maxsize = 256)
+def _read_fit(path, mtime):
+
+    # Parsed fit file, reused across BINAVERAGE runs until the file is rewritten (mtime is part of the key). Callers copy before modifying
+    return pd.read_excel(path)
+
 class BIOCONVERT():
     
-    def __init__(self, path, form_files, d_files, c_files, cellname, export_data = True, export_fig = True):
+    def __init__(self, path, form_files, d_files, c_files, cellname, export_data = True, export_fig = True, show_fig = True):
                 
         print("_________________________________")
         
@@ -52,77 +463,70 @@ class BIOCONVERT():
         all_files.extend(d_files)
         all_files.extend(c_files)
         firstFileLoc = Path(path) / all_files[0]
-        with open(firstFileLoc, 'r') as f:
+        with open(firstFileLoc, 'r', encoding = 'latin-1') as f:
             
             # Read beginning of first file to discover lines in header
-            f.readline()
-            hlinenum = int(f.readline().strip().split()[-1])
-            header = f.readlines()[:hlinenum-3]
+            hlinenum = _probe_header(f)
+            header = [f.readline() for i in range(hlinenum-3)]
             
-            # Acquire protocol name, capacity, active mass, and time started
-            protText = re.search('Loaded Setting File : (.+)', ''.join(header))
-            protName = protText.group(1).strip()
+            # Acquire protocol name, capacity, active mass, and time started in a single pass keeping the first match of each
+            headerVals = {}
+            for match in BIOHEADER.finditer(''.join(header)):
+                for key, val in match.groupdict().items():
+                    if val is not None:
+                        headerVals.setdefault(key, val)
             
-            massText = re.search('Mass of active material : (\d+.?\d+) (.+)', ''.join(header))
-            massVal = float(massText.group(1))
-            massUnit = massText.group(2).strip()
+            protName = headerVals['prot'].strip()
+            
+            massVal = float(headerVals['mass'])
+            massUnit = headerVals['massUnit'].strip()
             if massUnit != 'mg':
                 print("Mass Unit: " + massUnit)
                 print("Please edit first file to express mass in mg so that specific capacity is accurately calculated.\n")
             
-            capacityText = re.search('Battery capacity : (\d+.?\d+) (.+)', ''.join(header))
-            capacityVal = float(capacityText.group(1))
-            capacityUnit = capacityText.group(2).strip()
+            capacityVal = float(headerVals['capacity'])
+            capacityUnit = headerVals['capacityUnit'].strip()
             if capacityUnit != 'mA.h':
                 print("Capacity Unit: " + capacityUnit + "100")
                 print("Please edit first file to express capacity in mA.h so that specific capacity and rates are accurately calculated.\n")
             capacityUnit = capacityUnit.replace('.h', 'Hr')
             
-            startText = re.search('Technique started on : (.+)', ''.join(header))
-            startTime = startText.group(1).strip()
+            startTime = headerVals['start'].strip()
             
             # Write header text
             csvHeader = '[Summary]\nCell: ' + cellname + '\nFirst Protocol: ' + protName \
             + '\nMass (' + massUnit + '): ' + str(massVal) + '\nCapacity (' + capacityUnit + '): ' + str(capacityVal) \
             + '\nStarted: ' + startTime + '\n[End Summary]\n[Data]\n'
         
-        # Generate complete csv
-        df = pd.DataFrame({})
+        # Generate complete csv from each stage's dataframe
+        dfParts = []
         
         # Generate form dataframe if data available
         if form_files:
-            dfForm = pd.DataFrame({})
+            formParts = []
             
             # Read and combine form file data
-            for f in form_files:
-                formFileLoc = Path(path) / f
-                with open(formFileLoc, 'r') as f:
-            
-                    # Read beginning of form file to discover lines in header
-                    f.readline()
-                    hlinenum = int(f.readline().strip().split()[-1]) - 1
-                    
-                # Read file into dataframe and convert to UHPC format
-                dfTempForm = pd.read_csv(formFileLoc, skiprows = hlinenum, sep = '\t', encoding_errors = 'replace')
-                dfTempForm = dfTempForm[['mode', 'time/s', 'I/mA', 'Ewe-Ece/V', 'Ewe/V', '(Q-Qo)/mA.h', 'Ns']]
+            for dfTempForm in _read_biologic_files(path, form_files, BIOCOLUMNS):
                 
                 # Convert to NVX initial step convention
                 dfTempForm['Ns'] = dfTempForm['Ns'] + 1
                 
                 # Add last previous capacity, time, and step number to current data
-                if not(dfForm.empty):
-                    dfTempForm['time/s'] = dfTempForm['time/s'] + dfForm['time/s'].iat[-1]
-                    dfTempForm['(Q-Qo)/mA.h'] = dfTempForm['(Q-Qo)/mA.h'] + dfForm['(Q-Qo)/mA.h'].iat[-1]
-                    dfTempForm['Ns'] = dfTempForm['Ns'] + dfForm['Ns'].iat[-1]
+                if formParts:
+                    dfTempForm['time/s'] = dfTempForm['time/s'] + formParts[-1]['time/s'].iat[-1]
+                    dfTempForm['(Q-Qo)/mA.h'] = dfTempForm['(Q-Qo)/mA.h'] + formParts[-1]['(Q-Qo)/mA.h'].iat[-1]
+                    dfTempForm['Ns'] = dfTempForm['Ns'] + formParts[-1]['Ns'].iat[-1]
                 
-                # Concatenate
-                dfForm = pd.concat([dfForm, dfTempForm])
+                formParts.append(dfTempForm)
+            
+            # Concatenate
+            dfForm = pd.concat(formParts, ignore_index = True)
             
             # Convert to hours, base units, NVX labels, and NVX rest step convention while retaining order
             dfForm['time/s'] = dfForm['time/s'] / 3600
             dfForm['I/mA'] = dfForm['I/mA'] / 1000
             dfForm['(Q-Qo)/mA.h'] = dfForm['(Q-Qo)/mA.h'] / 1000
-            dfForm['mode'] = dfForm['mode'].replace(3, 0)
+            dfForm['mode'] = np.where(dfForm['mode'].to_numpy() == 3, 0, dfForm['mode'].to_numpy())
             
             dfForm.rename(columns = {'mode':'Step Type', 
                                    'time/s':'Run Time (h)', 
@@ -136,154 +540,40 @@ class BIOCONVERT():
             # Generate form file
             if export_data:
                 pathFileForm = Path(path) / (cellname + ' Form.csv')
+                print("Formation data exporting to:\n{}\n".format(str(pathFileForm)))
+                
+                # Header in text mode, then data appended by pandas, both with the platform line ending
                 with open(pathFileForm, 'w') as f:
                     f.write(csvHeader)
-                
-                print("Formation data exporting to:\n{}\n".format(str(pathFileForm)))
-                dfForm.to_csv(pathFileForm, mode = 'a', index = False)
+                dfForm.to_csv(pathFileForm, mode = 'a', index = False, chunksize = 100000)
             
-            # Concatenate
-            df = pd.concat([df, dfForm])
+            dfParts.append(dfForm)
         
         # Generate D dataframe if data available
         if d_files:
-            dfD = pd.DataFrame({})
+            dParts = []
             
             # Read, V average, and combine d file data
-            for file in d_files:
-                dFileLoc = Path(path) / file
-                with open(dFileLoc, 'r') as f:
-            
-                    # Read beginning of d file to discover lines in header
-                    f.readline()
-                    hlinenum = int(f.readline().strip().split()[-1]) - 1
-                    
-                # Read file into dataframe and convert to UHPC format
-                dfTempD = pd.read_csv(dFileLoc, skiprows = hlinenum, sep = '\t', encoding_errors = 'replace')
-                dfTempD = dfTempD[['mode', 'time/s', 'I/mA', 'Ewe-Ece/V', 'Ewe/V', '(Q-Qo)/mA.h', 'Ns', 'control/mA']]
+            for file, dfTempD in zip(d_files, _read_biologic_files(path, d_files, BIOCOLUMNS + ['control/mA'])):
     
                 # Convert 0A CC to NVX rest steps and trim off control I column
-                dfTempD['mode'].mask(dfTempD['control/mA'] == 0, 0, inplace = True)
-                dfTempD['mode'].mask(dfTempD['mode'] == 3, 0, inplace = True)
+                modeD = dfTempD['mode'].to_numpy()
+                dfTempD['mode'] = np.where((dfTempD['control/mA'].to_numpy() == 0) | (modeD == 3), 0, modeD)
                 dfTempD.drop(columns = ['control/mA'], inplace = True)
  
-                dfTempDSteps = dfTempD.drop_duplicates(subset = ['Ns'], ignore_index = True)
-                
-                # Detect if test ended prematurely
-                if dfTempDSteps['mode'].iloc[-1] != 0:
-                    
-                    # Add dummy step at end to prevent overindexing
-                    dummyD = dfTempD.loc[dfTempD.index[-1]:dfTempD.index[-1]].copy()
-                    dummyD['Ns'] = dummyD['Ns'] + 1
-                    dummyD['mode'] = 0
-                    dfTempD = pd.concat([dfTempD, dummyD], ignore_index = True)
-                    dfTempDSteps = pd.concat([dfTempDSteps, dummyD], ignore_index = True)
-                    
-                # Iterate over each pulse starting with their preceeding OCV V rest step    
-                for i in dfTempDSteps.index:
-                    if i != dfTempDSteps.index[-1]:
-                        if dfTempDSteps['mode'][i] == 0 and dfTempDSteps['mode'][i+1] != 0:
-                            
-                            # Average together all points of the rest step before a pulse into 1 point (OCV V)
-                            ocvFinSel = dfTempD['Ns'] == dfTempDSteps['Ns'][i]
-                            ocvFinVals = dfTempD[ocvFinSel].mean(axis = 0)
-                            dfTempD[ocvFinSel] = ocvFinVals
-                
-                            # Determine nAvg, the number of datapoints to average together so that there are 10 points in the first step
-                            nAvg = int(sum(dfTempD['Ns'] == dfTempDSteps['Ns'][i+1])/10)
-                            
-                            # Iterate over each CC step in pulse
-                            j = 1
-                            while dfTempDSteps['mode'][i+j] != 0:
-                                pulseInd = dfTempD[dfTempD['Ns'] == dfTempDSteps['Ns'][i+j]].index[0]
-                                
-                                # Give OCV V to first point in pulse else remove first point in CC step
-                                if j == 1:
-                                    dfTempD['Ewe-Ece/V'][pulseInd] = ocvFinVals['Ewe-Ece/V']
-                                    dfTempD['Ewe/V'][pulseInd] = ocvFinVals['Ewe/V']
-                                else:
-                                    dfTempD.drop([pulseInd], inplace = True)
-                                
-                                # Iterate over sets of nAvg datapoints within a CC step skipping the first and remainder datapoints
-                                if pulseInd + nAvg <= dfTempD.index[-1]:
-                                    while dfTempD['Ns'][pulseInd + nAvg] == dfTempDSteps['Ns'][i+j]:
-                                        
-                                        # Average together nAvg points into 1 point
-                                        CCPointVals = dfTempD.loc[pulseInd + 1:pulseInd + nAvg].mean(axis = 0)
-                                        dfTempD.loc[pulseInd + 1:pulseInd + nAvg] = CCPointVals.values
-                                        pulseInd = pulseInd + nAvg 
-                                        
-                                        if pulseInd + nAvg > dfTempD.index[-1]:
-                                            break
-                                    
-                                # Drop all remainder datapoints
-                                nextStepInd = dfTempD[dfTempD['Ns'] == dfTempDSteps['Ns'][i+j+1]].index[0]
-                                dfTempD.drop(dfTempD.loc[pulseInd + 1:nextStepInd - 1].index, inplace = True)
-                                
-                                j = j + 1
-                    else:
-                        
-                        # Calculate OCV V for end of final pulse
-                        if dfTempDSteps['mode'][i] == 0 and dfTempDSteps['mode'][i-1] == 0 and dfTempDSteps['mode'][i-2] == 0 and dfTempDSteps['mode'][i-3] == 1:
-                            
-                            # Average together all points of the rest step before a pulse into 1 point (OCV V)
-                            ocvFinSel = dfTempD['Ns'] == dfTempDSteps['Ns'][i]
-                            ocvFinVals = dfTempD[ocvFinSel].mean(axis = 0)
-                            dfTempD[ocvFinSel] = ocvFinVals
-                        
-                        # Label steps after last OCV V as CC to prevent analysis (Test stopped prematurely)
-                        else:
-                            print(file, 'stopped mid pulse. Labelling last pulse as unfinished to prevent analysis.')
-                            for i in range(len(dfTempDSteps.index)):
-                                if dfTempDSteps['mode'].iat[-i-1] == 0:
-                                    dfTempDSteps['mode'].iat[-i-1] = 1
-                                    dfTempD['mode'][dfTempD['Ns'] == dfTempDSteps['Ns'].iat[-i-1]] = 1
-                                else:
-                                    break
-                        
-                # Remove initial rest step series 
-                for i in range(len(dfTempDSteps.index)):
-                    if dfTempDSteps['mode'][i] == 0:
-                        dfTempD.drop(dfTempD.loc[dfTempD['Ns'] == dfTempDSteps['Ns'][i]].index, inplace = True)
-                        dfTempDSteps.drop(i, inplace = True)
-                    else:
-                        dfTempDSteps.reset_index(drop = True, inplace = True)
-                        break
-                
-                # Remove duplicates to simplify to one datapoint per averaging
-                dfTempD.drop_duplicates(inplace = True)
-                
-                # Combine all rest steps except for the last step in a series into 1 step
-                for i in range(len(dfTempDSteps.index)):
-                    if i != 0 and i != dfTempDSteps.index[-1]:
-                        if dfTempDSteps['mode'][i] == 0 and dfTempDSteps['mode'][i-1] == 0 and dfTempDSteps['mode'][i+1] == 0:
-                            dfTempD['Ns'][dfTempD['Ns'] == dfTempDSteps['Ns'][i]] = dfTempDSteps['Ns'][i-1]
-                            dfTempDSteps['Ns'][i] = dfTempDSteps['Ns'][i-1]
-                
-                # Combine all CC steps in a series
-                for i in range(len(dfTempDSteps.index)):
-                    if i != 0:
-                        if dfTempDSteps['mode'][i] != 0 and dfTempDSteps['mode'][i-1] != 0:
-                            dfTempD['Ns'][dfTempD['Ns'] == dfTempDSteps['Ns'][i]] = dfTempDSteps['Ns'][i-1]
-                            dfTempDSteps['Ns'][i] = dfTempDSteps['Ns'][i-1]
-                            
-                # Label last step as rest step if not already (Test stopped prematurely)
-                dfTempD['mode'].iloc[-1] = 0
-                dfTempDSteps['mode'].iloc[-1] = 0
+                # Average pulses and simplify step numbering
+                dfTempD = _average_pulses(dfTempD, file)
                 
-                # Relabel steps with continuous integers starting from 1
-                newDSteps = dfTempD.drop_duplicates(subset = ['Ns'], ignore_index = True)
-                dfTempD['Ns'].replace(newDSteps['Ns'].values, newDSteps.index+1, inplace = True)
-                dfTempDSteps['Ns'].replace(newDSteps['Ns'].values, newDSteps.index+1, inplace = True)
-                               
                 # Add last previous capacity, time, and step number to current data
-                if not(dfD.empty):
-                    dfTempD['time/s'] = dfTempD['time/s'] + dfD['time/s'].iat[-1]
-                    dfTempD['(Q-Qo)/mA.h'] = dfTempD['(Q-Qo)/mA.h'] + dfD['(Q-Qo)/mA.h'].iat[-1]
-                    dfTempD['Ns'] = dfTempD['Ns'] + dfD['Ns'].iat[-1]
+                if dParts:
+                    dfTempD['time/s'] = dfTempD['time/s'] + dParts[-1]['time/s'].iat[-1]
+                    dfTempD['(Q-Qo)/mA.h'] = dfTempD['(Q-Qo)/mA.h'] + dParts[-1]['(Q-Qo)/mA.h'].iat[-1]
+                    dfTempD['Ns'] = dfTempD['Ns'] + dParts[-1]['Ns'].iat[-1]
                 
-                # Concatenate 
-                dfD = pd.concat([dfD, dfTempD])
+                dParts.append(dfTempD)
+            
+            # Concatenate
+            dfD = pd.concat(dParts, ignore_index = True)
                 
             # Convert to hours, base units, and NVX labels while retaining order
             dfD['time/s'] = dfD['time/s'] / 3600
@@ -300,164 +590,49 @@ class BIOCONVERT():
                        inplace = True)
 
             # Add last capacity to output file
-            if not(df.empty):
-                dfD['Capacity (Ah)'] = dfD['Capacity (Ah)'] + df['Capacity (Ah)'].iat[-1]
+            if dfParts:
+                dfD['Capacity (Ah)'] = dfD['Capacity (Ah)'] + dfParts[-1]['Capacity (Ah)'].iat[-1]
                 
             # Generate D File
             if export_data:
                 pathFileD = Path(path) / (cellname + ' Discharge.csv')
-                with open(pathFileD, 'w') as f:
-                    f.write(csvHeader)      
-                    
                 print("Discharge data exporting to:\n{}\n".format(str(pathFileD)))
-                dfD.to_csv(pathFileD, mode = 'a', index = False)
+                
+                with open(pathFileD, 'w') as f:
+                    f.write(csvHeader)
+                dfD.to_csv(pathFileD, mode = 'a', index = False, chunksize = 100000)
                 
             # Add last time, and step number to graphs
-            if not(df.empty):
-                dfD['Run Time (h)'] = dfD['Run Time (h)'] + df['Run Time (h)'].iat[-1]
-                dfD['Step Number'] = dfD['Step Number'] + df['Step Number'].iat[-1]
+            if dfParts:
+                dfD['Run Time (h)'] = dfD['Run Time (h)'] + dfParts[-1]['Run Time (h)'].iat[-1]
+                dfD['Step Number'] = dfD['Step Number'] + dfParts[-1]['Step Number'].iat[-1]
                     
-            # Concatenate
-            df = pd.concat([df, dfD])
+            dfParts.append(dfD)
             
         # Generate C dataframe if data available
         if c_files:
-            dfC = pd.DataFrame({})
+            cParts = []
             
             # Read, V average, and combine c file data
-            for file in c_files:
-                cFileLoc = Path(path) / file
-                with open(cFileLoc, 'r') as f:
-            
-                    # Read beginning of c file to discover lines in header
-                    f.readline()
-                    hlinenum = int(f.readline().strip().split()[-1]) - 1
-                    
-                # Read file into dataframe and convert to UHPC format
-                dfTempC = pd.read_csv(cFileLoc, skiprows = hlinenum, sep = '\t', encoding_errors = 'replace')
-                dfTempC = dfTempC[['mode', 'time/s', 'I/mA', 'Ewe-Ece/V', 'Ewe/V', '(Q-Qo)/mA.h', 'Ns', 'control/mA']]
+            for file, dfTempC in zip(c_files, _read_biologic_files(path, c_files, BIOCOLUMNS + ['control/mA'])):
     
                 # Convert 0A CC to NVX rest steps and trim off control I column
-                dfTempC['mode'].mask(dfTempC['control/mA'] == 0, 0, inplace = True)
+                dfTempC['mode'] = np.where(dfTempC['control/mA'].to_numpy() == 0, 0, dfTempC['mode'].to_numpy())
                 dfTempC.drop(columns = ['control/mA'], inplace = True)
                 
-                dfTempCSteps = dfTempC.drop_duplicates(subset = ['Ns'], ignore_index = True)     
-                
-                # Detect if test ended prematurely
-                if dfTempCSteps['mode'].iloc[-1] != 0:
-                    
-                    # Add dummy step at end to prevent overindexing
-                    dummyC = dfTempC.loc[dfTempC.index[-1]:dfTempC.index[-1]].copy()
-                    dummyC['Ns'] = dummyC['Ns'] + 1
-                    dummyC['mode'] = 0
-                    dfTempC = pd.concat([dfTempC, dummyC], ignore_index = True)
-                    dfTempCSteps = pd.concat([dfTempCSteps, dummyC], ignore_index = True)
-                
-                # Iterate over each pulse starting with their preceeding OCV V rest step 
-                for i in dfTempCSteps.index:
-                    if i != dfTempCSteps.index[-1]:
-                        if dfTempCSteps['mode'][i] == 0 and dfTempCSteps['mode'][i+1] != 0:
-                            
-                            # Average together all points of the rest step before a pulse into 1 point (OCV V)
-                            ocvFinSel = dfTempC['Ns'] == dfTempCSteps['Ns'][i]
-                            ocvFinVals = dfTempC[ocvFinSel].mean(axis = 0)
-                            dfTempC[ocvFinSel] = ocvFinVals
-                
-                            # Determine nAvg, the number of datapoints to average together so that there are 10 points in the first step
-                            nAvg = int(sum(dfTempC['Ns'] == dfTempCSteps['Ns'][i+1])/10)
-                            
-                            # Iterate over each CC step in pulse
-                            j = 1
-                            while dfTempCSteps['mode'][i+j] != 0:
-                                pulseInd = dfTempC[dfTempC['Ns'] == dfTempCSteps['Ns'][i+j]].index[0]
-                                
-                                # Give OCV V to first point in pulse else remove first point in CC step
-                                if j == 1:
-                                    dfTempC['Ewe-Ece/V'][pulseInd] = ocvFinVals['Ewe-Ece/V']
-                                    dfTempC['Ewe/V'][pulseInd] = ocvFinVals['Ewe/V']
-                                else:
-                                    dfTempC.drop([pulseInd], inplace = True)
-                                
-                                # Iterate over sets of nAvg datapoints within a CC step skipping the first and remainder datapoints
-                                if pulseInd + nAvg <= dfTempC.index[-1]:
-                                    while dfTempC['Ns'][pulseInd + nAvg] == dfTempCSteps['Ns'][i+j]:
-                                        
-                                        # Average together nAvg points into 1 point
-                                        CCPointVals = dfTempC.loc[pulseInd + 1:pulseInd + nAvg].mean(axis = 0)
-                                        dfTempC.loc[pulseInd + 1:pulseInd + nAvg] = CCPointVals.values
-                                        pulseInd = pulseInd + nAvg 
-                                        
-                                        if pulseInd + nAvg > dfTempC.index[-1]:
-                                            break
-                                    
-                                # Drop all remainder datapoints
-                                nextStepInd = dfTempC[dfTempC['Ns'] == dfTempCSteps['Ns'][i+j+1]].index[0]
-                                dfTempC.drop(dfTempC.loc[pulseInd + 1:nextStepInd - 1].index, inplace = True)
-                                
-                                j = j + 1
-                    else:
-                        
-                        # Calculate OCV V for end of final pulse
-                        if dfTempCSteps['mode'][i] == 0 and dfTempCSteps['mode'][i-1] == 0 and dfTempCSteps['mode'][i-2] == 0 and dfTempCSteps['mode'][i-3] == 1:
-                            
-                            # Average together all points of the rest step before a pulse into 1 point (OCV V)
-                            ocvFinSel = dfTempC['Ns'] == dfTempCSteps['Ns'][i]
-                            ocvFinVals = dfTempC[ocvFinSel].mean(axis = 0)
-                            dfTempC[ocvFinSel] = ocvFinVals
-                        
-                        # Label steps after last OCV V as CC to prevent analysis (Test stopped prematurely)
-                        else:
-                            print(file, 'ended prematurely. Labeling last pulse as unfinished to prevent analysis.')
-                            for i in range(len(dfTempCSteps.index)):
-                                if dfTempCSteps['mode'].iat[-i-1] == 0:
-                                    dfTempCSteps['mode'].iat[-i-1] = 1
-                                    dfTempC['mode'][dfTempC['Ns'] == dfTempCSteps['Ns'].iat[-i-1]] = 1
-                                else:
-                                    break
-                        
-                # Remove initial rest step series 
-                for i in range(len(dfTempCSteps.index)):
-                    if dfTempCSteps['mode'][i] == 0:
-                        dfTempC.drop(dfTempC.loc[dfTempC['Ns'] == dfTempCSteps['Ns'][i]].index, inplace = True)
-                        dfTempCSteps.drop(i, inplace = True)
-                    else:
-                        dfTempCSteps.reset_index(drop = True, inplace = True)
-                        break
-                
-                # Remove duplicates to simplify to one datapoint per averaging
-                dfTempC.drop_duplicates(inplace = True)
-                
-                # Combine all rest steps in a series except for the last step into 1 step
-                for i in range(len(dfTempCSteps.index)):
-                    if i != 0 and i != dfTempCSteps.index[-1]:
-                        if dfTempCSteps['mode'][i] == 0 and dfTempCSteps['mode'][i-1] == 0 and dfTempCSteps['mode'][i+1] == 0:
-                            dfTempC['Ns'][dfTempC['Ns'] == dfTempCSteps['Ns'][i]] = dfTempCSteps['Ns'][i-1]
-                            dfTempCSteps['Ns'][i] = dfTempCSteps['Ns'][i-1]
-                
-                # Combine all CC steps in a series
-                for i in range(len(dfTempCSteps.index)):
-                    if i != 0:
-                        if dfTempCSteps['mode'][i] != 0 and dfTempCSteps['mode'][i-1] != 0:
-                            dfTempC['Ns'][dfTempC['Ns'] == dfTempCSteps['Ns'][i]] = dfTempCSteps['Ns'][i-1]
-                            dfTempCSteps['Ns'][i] = dfTempCSteps['Ns'][i-1]
-                
-                # Label last step as rest step if not already (Test stopped prematurely)
-                dfTempC['mode'].iloc[-1] = 0
-                dfTempCSteps['mode'].iloc[-1] = 0
-                
-                # Relabel steps with continuous integers starting from 1
-                newCSteps = dfTempC.drop_duplicates(subset = ['Ns'], ignore_index = True)
-                dfTempC['Ns'].replace(newCSteps['Ns'].values, newCSteps.index+1, inplace = True)
-                dfTempCSteps['Ns'].replace(newCSteps['Ns'].values, newCSteps.index+1, inplace = True)
+                # Average pulses and simplify step numbering
+                dfTempC = _average_pulses(dfTempC, file)
                 
                 # Add last previous capacity, time, and step number to current data
-                if not(dfC.empty):
-                    dfTempC['time/s'] = dfTempC['time/s'] + dfC['time/s'].iat[-1]
-                    dfTempC['(Q-Qo)/mA.h'] = dfTempC['(Q-Qo)/mA.h'] + dfC['(Q-Qo)/mA.h'].iat[-1]
-                    dfTempC['Ns'] = dfTempC['Ns'] + dfC['Ns'].iat[-1]
+                if cParts:
+                    dfTempC['time/s'] = dfTempC['time/s'] + cParts[-1]['time/s'].iat[-1]
+                    dfTempC['(Q-Qo)/mA.h'] = dfTempC['(Q-Qo)/mA.h'] + cParts[-1]['(Q-Qo)/mA.h'].iat[-1]
+                    dfTempC['Ns'] = dfTempC['Ns'] + cParts[-1]['Ns'].iat[-1]
                 
-                # Concatenate 
-                dfC = pd.concat([dfC, dfTempC])
+                cParts.append(dfTempC)
+            
+            # Concatenate
+            dfC = pd.concat(cParts, ignore_index = True)
                 
             # Convert to hours, base units, and NVX labels while retaining order
             dfC['time/s'] = dfC['time/s'] / 3600
@@ -474,48 +649,58 @@ class BIOCONVERT():
                        inplace = True)
             
             # Add last capacity to output file
-            if not(df.empty):
-                dfC['Capacity (Ah)'] = dfC['Capacity (Ah)'] + df['Capacity (Ah)'].iat[-1]
+            if dfParts:
+                dfC['Capacity (Ah)'] = dfC['Capacity (Ah)'] + dfParts[-1]['Capacity (Ah)'].iat[-1]
     
             # Generate C file
             if export_data:
                 pathFileC = Path(path) / (cellname + ' Charge.csv')
+                print("Charge data exporting to:\n{}\n".format(str(pathFileC)))
+                
                 with open(pathFileC, 'w') as f:
                     f.write(csvHeader)
-                            
-                print("Charge data exporting to:\n{}\n".format(str(pathFileC)))
-                dfC.to_csv(pathFileC, mode = 'a', index = False)
+                dfC.to_csv(pathFileC, mode = 'a', index = False, chunksize = 100000)
             
             # Add last time, and step number to graphs
-            if not(df.empty):
-                dfC['Run Time (h)'] = dfC['Run Time (h)'] + df['Run Time (h)'].iat[-1]
-                dfC['Step Number'] = dfC['Step Number'] + df['Step Number'].iat[-1]
+            if dfParts:
+                dfC['Run Time (h)'] = dfC['Run Time (h)'] + dfParts[-1]['Run Time (h)'].iat[-1]
+                dfC['Step Number'] = dfC['Step Number'] + dfParts[-1]['Step Number'].iat[-1]
                     
-            # Concatenate
-            df = pd.concat([df, dfC])
+            dfParts.append(dfC)
+        
+        # Concatenate
+        df = pd.concat(dfParts, ignore_index = True)
         
         # Generate full file
         if export_data:
             pathFile = Path(path) / (cellname + ' All.csv')
             with open(pathFile, 'w') as f:
                 f.write(csvHeader)
-                
-            df.to_csv(pathFile, mode = 'a', index = False)
+            df.to_csv(pathFile, mode = 'a', index = False, chunksize = 100000)
         
         # Generate complete graph
         fig, axs = plt.subplots(nrows = 1, ncols = 2, sharey = True, figsize = (6, 3), gridspec_kw = {'wspace':0.0})
         
+        # Bind plotted columns of each stage to arrays once
+        capScale = 1000000/massVal
+        stages = []
         if form_files:
-            axs[0].plot(dfForm['Run Time (h)'], dfForm['Potential vs. Counter (V)'], 'k--', label = 'Formation vs. $E_c$')
-            axs[0].plot(dfForm['Run Time (h)'], dfForm['Potential (V)'], 'k-', label = 'Formation vs. $E_r$')
-        
+            stages.append(('Formation', 'k', dfForm))
         if d_files:
-            axs[0].plot(dfD['Run Time (h)'], dfD['Potential vs. Counter (V)'], 'r--', label = 'Discharge vs. $E_c$')
-            axs[0].plot(dfD['Run Time (h)'], dfD['Potential (V)'], 'r-', label = 'Discharge vs. $E_r$')
-        
+            stages.append(('Discharge', 'r', dfD))
         if c_files:
-            axs[0].plot(dfC['Run Time (h)'], dfC['Potential vs. Counter (V)'], 'b--', label = 'Charge vs. $E_c$')
-            axs[0].plot(dfC['Run Time (h)'], dfC['Potential (V)'], 'b-', label = 'Charge vs. $E_r$')
+            stages.append(('Charge', 'b', dfC))
+        
+        stageArrays = [(name, color, 
+                        dfStage['Run Time (h)'].to_numpy(), 
+                        dfStage['Capacity (Ah)'].to_numpy()*capScale, 
+                        dfStage['Potential vs. Counter (V)'].to_numpy(), 
+                        dfStage['Potential (V)'].to_numpy()) 
+                       for name, color, dfStage in stages]
+        
+        for name, color, t, cap, Ec, Er in stageArrays:
+            axs[0].plot(*_decimate(t, Ec), color + '--', label = name + ' vs. $E_c$')
+            axs[0].plot(*_decimate(t, Er), color + '-', label = name + ' vs. $E_r$')
 
         axs[0].set_xlabel('Time (h)')
         axs[0].set_ylabel('Voltage (V)')
@@ -523,32 +708,25 @@ class BIOCONVERT():
         axs[0].yaxis.set_minor_locator(ticker.AutoMinorLocator())
         axs[0].grid(which = 'minor', color = 'lightgrey')
         
-        if form_files:
-            axs[1].plot(dfForm['Capacity (Ah)']*1000000/massVal, dfForm['Potential vs. Counter (V)'], 'k--', label = 'Formation vs. $E_c$')
-            axs[1].plot(dfForm['Capacity (Ah)']*1000000/massVal, dfForm['Potential (V)'], 'k-', label = 'Formation vs. $E_r$')
-        
-        if d_files:
-            axs[1].plot(dfD['Capacity (Ah)']*1000000/massVal, dfD['Potential vs. Counter (V)'], 'r--', label = 'Discharge vs. $E_c$')
-            axs[1].plot(dfD['Capacity (Ah)']*1000000/massVal, dfD['Potential (V)'], 'r-', label = 'Discharge vs. $E_r$')
-        
-        if c_files:
-            axs[1].plot(dfC['Capacity (Ah)']*1000000/massVal, dfC['Potential vs. Counter (V)'], 'b--', label = 'Charge vs. $E_c$')
-            axs[1].plot(dfC['Capacity (Ah)']*1000000/massVal, dfC['Potential (V)'], 'b-', label = 'Charge vs. $E_r$')
+        for name, color, t, cap, Ec, Er in stageArrays:
+            axs[1].plot(*_decimate(cap, Ec), color + '--', label = name + ' vs. $E_c$')
+            axs[1].plot(*_decimate(cap, Er), color + '-', label = name + ' vs. $E_r$')
         
         axs[1].set_xlabel('Specific Capacity\n(mAh g$\mathregular{^{-1}}$)')
         axs[1].xaxis.set_minor_locator(ticker.AutoMinorLocator())
         axs[1].yaxis.set_minor_locator(ticker.AutoMinorLocator())
         axs[1].grid(which = 'minor', color = 'lightgrey')
         
-        plt.legend(bbox_to_anchor = (1.0, 0.5), loc = 'center left')
+        axs[1].legend(bbox_to_anchor = (1.0, 0.5), loc = 'center left')
         
         if export_fig:
             figname = Path(path) / '{} Protocol.jpg'.format(cellname)
             print(figname)
-            plt.savefig(figname, bbox_inches = 'tight')
+            fig.savefig(figname, bbox_inches = 'tight')
         
-        plt.show()
-        plt.close()
+        if show_fig:
+            plt.show()
+        plt.close(fig)
         print("")
         
         if d_files and c_files:
@@ -556,22 +734,23 @@ class BIOCONVERT():
             dfCOCV = dfC[dfC['Step Type'] != 0].drop_duplicates(['Step Number'])
             
             fig, axs = plt.subplots(nrows = 1, ncols = 1, figsize = (6, 3), gridspec_kw = {'wspace':0.0})
-            axs.plot(dfDOCV['Capacity (Ah)']*1000000/massVal, dfDOCV['Potential (V)'], 'r.-', label = 'Discharge Relaxed vs. $E_r$')
-            axs.plot(dfCOCV['Capacity (Ah)']*1000000/massVal, dfCOCV['Potential (V)'], 'b.-', label = 'Charge Relaxed vs. $E_r$')
+            axs.plot(dfDOCV['Capacity (Ah)'].to_numpy()*capScale, dfDOCV['Potential (V)'], 'r.-', label = 'Discharge Relaxed vs. $E_r$')
+            axs.plot(dfCOCV['Capacity (Ah)'].to_numpy()*capScale, dfCOCV['Potential (V)'], 'b.-', label = 'Charge Relaxed vs. $E_r$')
             axs.set_xlabel('Specific Capacity\n(mAh g$\mathregular{^{-1}}$)')
             axs.set_ylabel('Voltage (V)')
             axs.xaxis.set_minor_locator(ticker.AutoMinorLocator())
             axs.yaxis.set_minor_locator(ticker.AutoMinorLocator())
             axs.grid(which = 'minor', color = 'lightgrey')
-            plt.legend(frameon = True)
+            axs.legend(frameon = True)
             
             if export_fig:
                 figname = Path(path) / '{} Relax Match.jpg'.format(cellname)
                 print(figname)
-                plt.savefig(figname, bbox_inches = 'tight')
+                fig.savefig(figname, bbox_inches = 'tight')
             
-            plt.show()
-            plt.close()
+            if show_fig:
+                plt.show()
+            plt.close(fig)
             print("")
         
 class AMIDR():
@@ -600,40 +779,35 @@ class AMIDR():
         
         self.uhpc_file = self.src / uhpc_file
              
-        with open(self.uhpc_file, 'r') as f:
-            lines = f.readlines()
-        nlines = len(lines)
+        # Read lines only up to the [Data] marker rather than the whole file
         headlines = []
-        for i in range(nlines):
-            headlines.append(lines[i])
-            l = lines[i].strip().split()
-            if l[0][:6] == '[Data]':
-                nskip = i+1
-                break
+        with open(self.uhpc_file, 'r') as f:
+            for i, line in enumerate(f):
+                headlines.append(line)
+                if line.strip()[:6] == '[Data]':
+                    nskip = i+1
+                    break
         
         header = ''.join(headlines)
-        del lines
                 
-        # find mass and theoretical cap using re on header str
-        m = re.search('Mass\s+\(.*\):\s+(\d+)?\.\d+', header)
-        m = m.group(0).split()
-        mass_units = m[1][1:-2]
-        if mass_units == 'mg':
-            self.mass = float(m[-1]) / 1000
+        # find mass, theoretical cap and cell name in a single pass keeping the first match of each
+        headerVals = {}
+        for match in UHPCHEADER.finditer(header):
+            for key, val in match.groupdict().items():
+                if val is not None:
+                    headerVals.setdefault(key, val)
+        
+        if headerVals['massUnit'] == 'mg':
+            self.mass = float(headerVals['mass']) / 1000
         else:
-            self.mass = float(m[-1])
+            self.mass = float(headerVals['mass'])
         
-        m = re.search('Capacity\s+(.*):\s+(\d+)?\.\d+', header)
-        m = m.group(0).split()
-        cap_units = m[1][1:-2]
-        if cap_units == 'mAHr':
-            self.input_cap = float(m[-1]) / 1000
+        if headerVals['capacityUnit'] == 'mAHr':
+            self.input_cap = float(headerVals['capacity']) / 1000
         else:
-            self.input_cap = float(m[-1])
+            self.input_cap = float(headerVals['capacity'])
             
-        m = re.search('Cell: .+?(?=,|\\n)', header)
-        m = m.group(0).split()
-        self.cellname = ' '.join(m[1:])
+        self.cellname = ' '.join(headerVals['cell'].split())
         
         #self.cellname = headlines[1][-1]
         #self.mass = float(headlines[4][-1]) / 1000
@@ -652,7 +826,7 @@ class AMIDR():
         print("Positive electrode active mass: {} g".format(self.mass))
         print("Input cell capacity: {} Ah\n".format(round(self.input_cap, 10)))
         
-        self.df = pd.read_csv(self.uhpc_file, header = nskip)
+        self.df = pd.read_csv(self.uhpc_file, header = nskip, engine = CSV_ENGINE)
         
         self.df.rename(columns = {'Capacity (Ah)': 'Capacity', 
                                   'Potential (V)': 'Potential', 
@@ -675,21 +849,28 @@ class AMIDR():
             s = self.df.Step
             self.df['Prot_step'] = s.ne(s.shift()).cumsum() - 1
         
+        # Store step codes in narrow integer types. Measured columns stay float64 for the exact voltage cutoff checks.
+        self.df = self.df.astype({'Step': np.int16, 'Prot_step': np.int32})
+        
         # Adjust data where time is not monotonically increasing.   
-        t = self.df['Time'].values
-        cap = self.df['Capacity'].values
+        t = self.df['Time'].to_numpy(copy = True)
+        cap = self.df['Capacity'].to_numpy(copy = True)
         dt = t[1:] - t[:-1]
         indst = np.where(dt < 0.0)[0]
         if len(indst) > 0:
             print("Indices being adjusted due to time non-monotonicity: {}".format(indst))
-            self.df['Time'][indst+1] = (t[indst] + t[indst+2])/2
-            self.df['Capacity'][indst+1] = (cap[indst] + cap[indst+2])/2
+            t[indst+1] = (t[indst] + t[indst+2])/2
+            cap[indst+1] = (cap[indst] + cap[indst+2])/2
+            self.df['Time'] = t
+            self.df['Capacity'] = cap
             
         # Adjust data where potential is negative.
-        indsn = self.df.index[self.df['Potential'] < 0.0].tolist()
+        v = self.df['Potential'].to_numpy(copy = True)
+        indsn = np.where(v < 0.0)[0]
         if len(indsn) > 0:
-            print("Indices being adjusted due to negative voltage: {}".format(indsn))
-            self.df['Potential'][indsn] = (t[indsn-1] + t[indsn+1])/2
+            print("Indices being adjusted due to negative voltage: {}".format(indsn.tolist()))
+            v[indsn] = (v[indsn-1] + v[indsn+1])/2
+            self.df['Potential'] = v
             
         if len(indst) > 0 or len(indsn) > 0: print("\n")
         
@@ -719,52 +900,57 @@ class AMIDR():
         
         if export_data:
             caprate_fname = self.dst / '{0} Parsed.xlsx'.format(self.cell_label)
-            writer = pd.ExcelWriter(caprate_fname)
-            for i in range(self.nvolts):
-                if self.single_p is False:
-                    caprate_df = pd.DataFrame(data = {'Specific Capacity': self.cumcaps[i],
-                                                    'Fractional Capacity': self.fcaps[i],
-                                                    'Effective C/n Rate': self.eff_rates[i],
-                                                    'C/n Rate': self.rates[i]})
-                else:
-                    caprate_df = pd.DataFrame(data = {'Specific Capacity': self.caps[i],
-                                                    'Voltage': self.volts[i],
-                                                    'Fractional Capacity': self.fcaps[i],
-                                                    'qi/I': self.eff_rates[i]})
-                caprate_df.to_excel(writer, sheet_name = self.vlabels[i], index = False)
-            print("Parsed data exporting to:\n{0}\n".format(str(caprate_fname)))
-            writer.save()
-            writer.close()
+            with pd.ExcelWriter(caprate_fname) as writer:
+                for i in range(self.nvolts):
+                    if self.single_p is False:
+                        caprate_df = pd.DataFrame(data = {'Specific Capacity': self.cumcaps[i],
+                                                        'Fractional Capacity': self.fcaps[i],
+                                                        'Effective C/n Rate': self.eff_rates[i],
+                                                        'C/n Rate': self.rates[i]})
+                    else:
+                        caprate_df = pd.DataFrame(data = {'Specific Capacity': self.caps[i],
+                                                        'Voltage': self.volts[i],
+                                                        'Fractional Capacity': self.fcaps[i],
+                                                        'qi/I': self.eff_rates[i]})
+                    caprate_df.to_excel(writer, sheet_name = self.vlabels[i], index = False)
+                print("Parsed data exporting to:\n{0}\n".format(str(caprate_fname)))
 
     def _find_sigcurves(self):
         # Use control "step" to find sequence of charge/discharge - OCV characteristic of signature curves.
         
-        newdf = self.df.drop_duplicates(subset = ['Step', 'Prot_step'])
-        steps = newdf['Step'].values
-        prosteps = newdf['Prot_step'].values
+        # First row of every step found from changes in consecutive rows
+        st = self.df['Step'].to_numpy()
+        ps = self.df['Prot_step'].to_numpy()
+        newstep = np.empty(len(ps), dtype = bool)
+        newstep[0] = True
+        newstep[1:] = (ps[1:] != ps[:-1]) | (st[1:] != st[:-1])
+        steps = st[newstep]
+        prosteps = ps[newstep]
         ocv_inds = np.where(steps == 0)[0]
         
         if self.single_p is False:
             # Require a min of 3 OCV steps with the same step before and after
             # to qualify as a signature curve.
             
-            for i in range(len(ocv_inds)):
-                if steps[ocv_inds[i] - 1] == steps[ocv_inds[i+2] + 1]:
-                    first_sig_step = prosteps[ocv_inds[i] - 1]
-                    break
+            # Steps around each OCV step, padded so steps past the end of the file never match
+            padsteps = np.r_[steps, np.nan, np.nan]
+            before = steps[ocv_inds - 1]
+            after = padsteps[ocv_inds + 1]
+            after2 = padsteps[ocv_inds + 2]
             
-            for i in range(len(ocv_inds)):
-                ind = -i - 1
-                if steps[ocv_inds[ind] + 1] != steps[ocv_inds[ind] - 1]:
-                    last_sig_step = prosteps[ocv_inds[ind] - 1]
-                    break
-                    
-                elif steps[ocv_inds[ind] + 1] != steps[ocv_inds[ind] + 2]:
-                    last_sig_step = prosteps[ocv_inds[ind] + 1]
-                    break
-                    
-            if i == len(ocv_inds) - 1:
+            match = np.flatnonzero(before[:-2] == after[2:])
+            if len(match) == 0:
+                raise ValueError("No 3 OCV steps with the same step before and after detected. Protocol is likely single_pulse.")
+            first_sig_step = prosteps[ocv_inds[match[0]] - 1]
+            
+            # Signature curves end at the last OCV step whose neighbouring steps break the pattern
+            ends = np.flatnonzero((after != before) | (after != after2))
+            if len(ends) == 0:
                 last_sig_step = prosteps[ocv_inds[-1] + 1]
+            elif after[ends[-1]] != before[ends[-1]]:
+                last_sig_step = prosteps[ocv_inds[ends[-1]] - 1]
+            else:
+                last_sig_step = prosteps[ocv_inds[ends[-1]] + 1]
         else:
             #single_pulse sigcurves selection
             for i in range(len(ocv_inds)):
@@ -794,6 +980,8 @@ class AMIDR():
         
         sigsteps = sigs['Prot_step'].unique()
         nsig = len(sigsteps)
+        # Group steps once rather than scanning the frame for every step
+        sigsteps_df = {k: g for k, g in sigs.groupby('Prot_step', sort = False)}
         print("Found {} pulse steps in signature curves.\n".format(nsig))
         caps = []
         cumcaps = []
@@ -811,13 +999,17 @@ class AMIDR():
         eff_rates = []
         
         if self.single_p is False:
+            # Capacity and voltage spans of every step from one grouped reduction
+            stepgroups = sigs.groupby('Prot_step', sort = False)[['Capacity', 'Potential']]
+            spans = (stepgroups.max() - stepgroups.min()).to_numpy()
+            rows = []
+            starts = []
             for i in range(nsig):
-                step = sigs.loc[sigs['Prot_step'] == sigsteps[i]]
+                step = sigsteps_df[sigsteps[i]]
                 pulsecaps = step['Capacity'].values
                 pulsevolts = step['Potential'].values
                 currents = np.absolute(step['Current'].values)
-                rate = self.capacity / np.average(currents)
-                minarg = np.argmin(np.absolute(RATES - rate))
+                rate = _nearest_rate(self.capacity / np.average(currents))
                 
                 # slice first and last current values if possible.
                 # if less than 4(NVX) or 5(UHPC) data points, immediate voltage cutoff reached, omit step.
@@ -836,71 +1028,56 @@ class AMIDR():
                 else:
                     continue
                     
-                # determine dqdv based on the measurements before the voltage cutoff
-                diffq = (pulsecaps[cvoltind-2] - pulsecaps[cvoltind-1]) / (pulsevolts[cvoltind-2] - pulsevolts[cvoltind-1])
-            
-                if caps == []:
-                    caps.append([np.amax(pulsecaps) - np.amin(pulsecaps)])
-                    volts.append([np.amax(pulsevolts) - np.amin(pulsevolts)])
-                    rates.append([RATES[minarg]])
-                    initcap.append([pulsecaps[0]])
-                    cutcap.append([pulsecaps[cvoltind]])
-                    initvolts.append([pulsevolts[0]])
-                    cutvolts.append([pulsevolts[cvoltind]])
-                    currs.append([np.average(currents)])
-                    ir.append([np.absolute(pulsevolts[0] - pulsevolts[1])])
-                    dqdv.append([diffq])
-                    resistdrop.append([ir[-1][-1]/currs[-1][-1]])
-                else:
-                    if pulsevolts[cvoltind] == cutvolts[-1][-1]:
-                        caps[-1].append(np.amax(pulsecaps) - np.amin(pulsecaps))
-                        volts[-1].append(np.amax(pulsevolts) - np.amin(pulsevolts))
-                        rates[-1].append(RATES[minarg])
-                        cutcap[-1].append(pulsecaps[cvoltind])
-                        cutvolts[-1].append(pulsevolts[cvoltind])
-                        currs[-1].append(np.average(currents))
-                        ir[-1].append(np.absolute(pulsevolts[0] - pulsevolts[1]))
-                        dqdv[-1].append(diffq)
-                        resistdrop[-1].append(ir[-1][-1]/currs[-1][-1])
-                    else:
-                        if np.absolute(pulsevolts[-2] - cutvolts[-1][-1]) < 0.001:
-                            continue
-                        caps.append([np.amax(pulsecaps) - np.amin(pulsecaps)])
-                        volts.append([np.amax(pulsevolts) - np.amin(pulsevolts)])
-                        rates.append([RATES[minarg]])
-                        initcap.append([pulsecaps[0]])
-                        cutcap.append([pulsecaps[cvoltind]])
-                        initvolts.append([pulsevolts[0]])
-                        cutvolts.append([pulsevolts[cvoltind]])
-                        currs.append([np.average(currents)])
-                        ir.append([np.absolute(pulsevolts[0] - pulsevolts[1])])
-                        dqdv.append([diffq])
-                        resistdrop.append([ir[-1][-1]/currs[-1][-1]])
+                pcap, ccap, pvolt, cvolt, avgcurr, irdrop, diffq = _pulse_stats(pulsecaps, pulsevolts, currents, cvoltind)
+
+                # A new voltage interval starts whenever the cutoff voltage changes
+                newint = rows == [] or cvolt != rows[-1][6]
+                if newint and rows != [] and np.absolute(pulsevolts[-2] - rows[-1][6]) < 0.001:
+                    continue
+                if newint:
+                    starts.append(len(rows))
+                rows.append((*spans[i], rate, pcap, ccap, pvolt, cvolt, avgcurr, irdrop, diffq))
+            
+            # Split the per-pulse columns into one array per voltage interval
+            capcol, voltcol, ratecol, pcapcol, ccapcol, pvoltcol, cvoltcol, currcol, ircol, dqdvcol = np.array(rows).reshape(-1, 10).T
+            intervals = [slice(a, b) for a, b in zip(starts, starts[1:] + [len(rows)])]
+            caps = [capcol[s] for s in intervals]
+            volts = [voltcol[s] for s in intervals]
+            rates = [ratecol[s] for s in intervals]
+            initcap = [pcapcol[s.start:s.start+1] for s in intervals]
+            cutcap = [ccapcol[s] for s in intervals]
+            initvolts = [pvoltcol[s.start:s.start+1] for s in intervals]
+            cutvolts = [cvoltcol[s] for s in intervals]
+            currs = [currcol[s] for s in intervals]
+            ir = [ircol[s] for s in intervals]
+            dqdv = [dqdvcol[s] for s in intervals]
+            resistdrop = [ircol[s]/currcol[s] for s in intervals]
             
             nvolts = len(caps)
             for i in range(nvolts):
-                fcaps.append(np.cumsum(caps[i]) / np.sum(caps[i]))
                 cumcaps.append(np.cumsum(caps[i]))
+                fcaps.append(cumcaps[i] / cumcaps[i][-1])
                 
                 eff_rates.append(cumcaps[i][-1]/currs[i])
                 
                 # Remove data where capacity is too small due to IR
                 # i.e., voltage cutoff was reached immediately.
-                inds = np.where(fcaps[i] < self.fcap_min)[0]
-                if len(inds) > 0:
-                    print("{0} Pulse(s) to {1} removed due to being below fcap min.\n".format(eff_rates[i][inds], cutvolts[i][inds]))
-                    caps[i] = np.delete(caps[i], inds)
-                    volts[i] = np.delete(volts[i], inds)
-                    cumcaps[i] = np.delete(cumcaps[i], inds)
-                    fcaps[i] = np.delete(fcaps[i], inds)
-                    eff_rates[i] = np.delete(eff_rates[i], inds)
-                    rates[i] = np.delete(rates[i], inds)
-                    cutcap[i] = np.delete(cutcap[i], inds)
-                    cutvolts[i] = np.delete(cutvolts[i], inds)
-                    currs[i] = np.delete(currs[i], inds)
-                    ir[i] = np.delete(ir[i], inds)
-                    dqdv[i] = np.delete(dqdv[i], inds)
-                    resistdrop[i] = np.delete(resistdrop[i], inds)
+                drop = fcaps[i] < self.fcap_min
+                if drop.any():
+                    keep = ~drop
+                    print("{0} Pulse(s) to {1} removed due to being below fcap min.\n".format(eff_rates[i][drop], cutvolts[i][drop]))
+                    caps[i] = caps[i][keep]
+                    volts[i] = volts[i][keep]
+                    cumcaps[i] = cumcaps[i][keep]
+                    fcaps[i] = fcaps[i][keep]
+                    eff_rates[i] = eff_rates[i][keep]
+                    rates[i] = rates[i][keep]
+                    cutcap[i] = cutcap[i][keep]
+                    cutvolts[i] = cutvolts[i][keep]
+                    currs[i] = currs[i][keep]
+                    ir[i] = ir[i][keep]
+                    dqdv[i] = dqdv[i][keep]
+                    resistdrop[i] = resistdrop[i][keep]
         
             if self.capacitance_corr == True:
                 print("Capacitance correction cannot be applied to multi-pulse AMID data. Data is being analyzed without capacitance correction.\n")
@@ -911,8 +1088,9 @@ class AMIDR():
             cumcurrs = []
             voltsAct = []
             time = []
+            allsteps_df = {k: g for k, g in self.sigdf.groupby('Prot_step', sort = False)}
             for i in range(nsig):
-                step = sigs.loc[sigs['Prot_step'] == sigsteps[i]]
+                step = sigsteps_df[sigsteps[i]]
                 pulsecaps = step['Capacity'].values
                 pulsevolts = step['Potential'].values
                 lpulsevolts = step['Label Potential'].values
@@ -920,9 +1098,9 @@ class AMIDR():
                 runtime = step['Time'].values
                 
                 # Collect succeeding OCV steps (1 OCV or 2 OCV) to calculate dqdv
-                ocvstep = self.sigdf.loc[self.sigdf['Prot_step'] == sigsteps[i] + 2]
+                ocvstep = allsteps_df[sigsteps[i] + 2]
                 if ocvstep['Step'].values[0] != 0:
-                    ocvstep = self.sigdf.loc[self.sigdf['Prot_step'] == sigsteps[i] + 1]
+                    ocvstep = allsteps_df[sigsteps[i] + 1]
                 ocvpulsecaps = ocvstep['Capacity'].values
                 ocvvolts = ocvstep['Potential'].values
                 ocvlvolts = ocvstep['Label Potential'].values
@@ -947,12 +1125,8 @@ class AMIDR():
                 currs.append(currents[1:])
                 voltsAct.append(pulsevolts[1:])
                 
-                cumcurrs.append([])
-                rates.append([])
-                for j in range(len(currents[1:])):
-                    cumcurrs[-1].append(np.average(currents[1:j+2]))
-                    minarg = np.argmin(np.absolute(RATES - self.capacity / cumcurrs[-1][j]))
-                    rates[-1].append(RATES[minarg])
+                cumcurrs.append(np.cumsum(currents[1:]) / np.arange(1, len(currents)))
+                rates.append(list(_nearest_rate(self.capacity / cumcurrs[-1])))
                 if len(pulsevolts) > 1:
                     resistdrop.append([ir[-1][0]/currs[-1][0]])
                 else:
@@ -961,97 +1135,85 @@ class AMIDR():
             nvolts = len(caps)
             
             if self.capacitance_corr == True:
-                #DL capacitance is calculated from the first 5 consistent current datapoints in the lowest V pulse.
+                #DL capacitance is calculated from the first 8 consistent current datapoints in the lowest V pulse.
                 lowVind = cutvolts.index(min(cutvolts))
 
-                A = np.ones((8, 2))
-                y = np.zeros(8)
-                n = 0
-                for i in range(len(currs[lowVind])):
-                    if n == 8:
-                        break
-                    if abs(currs[lowVind][i]/currs[lowVind][i+1] - 1) < 0.01:
-                        A[n][0] = voltsAct[lowVind][i+1]
-                        y[n] = caps[lowVind][i+1]
-                        n = n + 1
-                    else:
-                        A = np.ones((8, 2))
-                        y = np.zeros(8)
-                        n = 0
-                
-                capacitance = abs(np.linalg.lstsq(A, y)[0][0])
+                # Start of the first run of 8 datapoints whose current is within 1% of the previous one
+                stable = np.absolute(currs[lowVind][:-1]/currs[lowVind][1:] - 1) < 0.01
+                runs = np.flatnonzero(np.convolve(stable, np.ones(8), 'valid') == 8)
+                if len(runs) > 0:
+                    x = voltsAct[lowVind][runs[0]+1:runs[0]+9]
+                    y = caps[lowVind][runs[0]+1:runs[0]+9]
+                    # Closed form least squares slope of capacity against voltage
+                    capacitance = abs(np.sum((x - x.mean())*(y - y.mean())) / np.sum((x - x.mean())**2))
+                else:
+                    print("No 8 consistent current datapoints found in the lowest V pulse. Double layer capacitance set to 0.")
+                    capacitance = 0.0
                 print("Double layer capacitance found at lowest V pulse: {:.2f} nF".format(1.0e9*capacitance))
                 
-                rohm = np.power(10, stats.mode(np.round(np.log10(resistdrop), 2))[0])[0][0]
+                # Most common ohmic resistance in 0.01 decade bins (smallest bin wins ties)
+                logr, counts = np.unique(np.round(np.log10(np.concatenate(resistdrop)), 2), return_counts = True)
+                rohm = np.power(10, logr[counts.argmax()])
                 print("Logarithmic mode of ohmic resistance over all pulses: {:.2f} Ω\n".format(rohm))
                 for i in range(nvolts):
-                    dlcaps = []
-                    for j in range(len(voltsAct[i])):
-                        if voltsAct[i][0] > voltsAct[i][-1]:
-                            if voltsAct[i][0] + ir[i][0] - currs[i][j]*rohm > voltsAct[i][j]:
-                                dlcaps.append(capacitance*((voltsAct[i][0] + ir[i][0] - currs[i][j]*rohm) - voltsAct[i][j]))
-                            else:
-                                dlcaps.append(0)
-                        else:
-                            if voltsAct[i][0] - ir[i][0] + currs[i][j]*rohm < voltsAct[i][j]:
-                                dlcaps.append(capacitance*(voltsAct[i][j] - (voltsAct[i][0] - ir[i][0] + currs[i][j]*rohm)))
-                            else:
-                                dlcaps.append(0)
+                    # Double layer charge from the gap between the measured voltage and the ohmic-predicted voltage
+                    if voltsAct[i][0] > voltsAct[i][-1]:
+                        dv = (voltsAct[i][0] + ir[i][0] - currs[i]*rohm) - voltsAct[i]
+                    else:
+                        dv = voltsAct[i] - (voltsAct[i][0] - ir[i][0] + currs[i]*rohm)
+                    dlcaps = np.where(dv > 0, capacitance*dv, 0)
 
                     caps[i] = caps[i] - dlcaps
                     # if caps is calculated as negative, this datapoint is effectively thrown out (caps set to 0)
-                    for j in range(len(caps[i])):
-                        if caps[i][j] < 0:
-                            caps[i][j] = 0
+                    caps[i][caps[i] < 0] = 0
                     
                     idcaps[i] = idcaps[i] - dlcaps
-                    # if idcaps is calculated as negative or zero, this datapoint is effectively thrown out (caps set to nan)
-                    for j in range(len(caps[i])):
-                        if idcaps[i][j] <= 0:
-                            idcaps[i][j] = float('NaN')
-                    
                     #cumcurrs[i] = cumcurrs[i] - dlcaps/time[i] # disabled as it may amplify error if near 0
-                    # if cumulative current is calculated as negative or zero, this datapoint is effectively thrown out (caps set to nan)
-                    for j in range(len(caps[i])):
-                        if cumcurrs[i][j] <= 0:
-                            cumcurrs[i][j] = float('NaN')
             
             for i in range(nvolts):
-                fcaps.append(caps[i]/idcaps[i])
-                eff_rates.append(idcaps[i]/cumcurrs[i])
+                with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                    fcaps.append(caps[i]/idcaps[i])
+                    eff_rates.append(idcaps[i]/cumcurrs[i])
+                if self.capacitance_corr == True:
+                    # if idcaps or cumulative current is calculated as negative or zero, this datapoint is effectively thrown out (set to nan)
+                    inv = (idcaps[i] <= 0) | (cumcurrs[i] <= 0)
+                    fcaps[i][inv] = np.nan
+                    eff_rates[i][inv] = np.nan
                 
                 # outlier repair: if fcap or eff_rates is NaN, make it equal to the succeeding point (or previous if last point).
-                for j in range(len(caps[i])):
-                    if fcaps[i][-j - 1] != fcaps[i][-j - 1] or eff_rates[i][-j - 1] != eff_rates[i][-j - 1]:
-                        fcaps[i][-j - 1] = fcaps[i][-j]
-                        eff_rates[i][-j - 1] = eff_rates[i][-j]
+                bad = np.isnan(fcaps[i]) | np.isnan(eff_rates[i])
+                if bad.any():
+                    # Last point takes the first point, then every other bad point takes the next good one
+                    nxt = np.where(bad, len(bad), np.arange(len(bad)))
+                    nxt[-1] = len(bad) - 1
+                    nxt = np.minimum.accumulate(nxt[::-1])[::-1]
+                    if bad[-1]:
+                        fcaps[i][-1] = fcaps[i][0]
+                        eff_rates[i][-1] = eff_rates[i][0]
+                    fcaps[i] = fcaps[i][nxt]
+                    eff_rates[i] = eff_rates[i][nxt]
                         
                 # Remove data where relative capacity is small due to IR and error from pulse initiation exists.
-                inds = np.where(fcaps[i] < self.fcap_min)[0]
-                if len(inds) > 0:
-                    print("{0} datapoint(s) in pulse to {1} removed due to being below fcap min.\n".format(len(inds), cutvolts[i][0]))
-                    caps[i] = np.delete(caps[i], inds)
-                    volts[i] = np.delete(volts[i], inds)
-                    cumcaps[i] = np.delete(cumcaps[i], inds)
-                    fcaps[i] = np.delete(fcaps[i], inds)
-                    eff_rates[i] = np.delete(eff_rates[i], inds)
-                    rates[i] = np.delete(rates[i], inds)
-                    currs[i] = np.delete(currs[i], inds)
-                
-        ivolts = np.zeros(nvolts)
-        cvolts = np.zeros(nvolts)
-        icaps = np.zeros(nvolts)
-        ccaps = np.zeros(nvolts)
-        for i in range(nvolts):
-            ivolts[i] = np.average(initvolts[i])
-            cvolts[i] = np.average(cutvolts[i])
-            icaps[i] = np.average(initcap[i])
-            ccaps[i] = cutcap[i][-1]
+                drop = fcaps[i] < self.fcap_min
+                if drop.any():
+                    keep = ~drop
+                    print("{0} datapoint(s) in pulse to {1} removed due to being below fcap min.\n".format(np.count_nonzero(drop), cutvolts[i][0]))
+                    caps[i] = caps[i][keep]
+                    volts[i] = volts[i][keep]
+                    cumcaps[i] = cumcaps[i][keep]
+                    fcaps[i] = fcaps[i][keep]
+                    eff_rates[i] = eff_rates[i][keep]
+                    rates[i] = np.asarray(rates[i])[keep]
+                    currs[i] = currs[i][keep]
+                
+        ivolts = np.fromiter((np.mean(v) for v in initvolts), dtype = float, count = nvolts)
+        cvolts = np.fromiter((np.mean(v) for v in cutvolts), dtype = float, count = nvolts)
+        icaps = np.fromiter((np.mean(c) for c in initcap), dtype = float, count = nvolts)
+        ccaps = np.fromiter((c[-1] for c in cutcap), dtype = float, count = nvolts)
         
         with np.printoptions(precision = 3):
             avg_caps = (icaps + ccaps)/2
             avg_volts = (ivolts + cvolts)/2                
-            dvolts = np.zeros(nvolts)
             dvolts = np.absolute(ivolts - cvolts)
             vlabels = ['{0:.3f} V - {1:.3f} V'.format(ivolts[i], cvolts[i]) for i in range(nvolts)]
             if self.single_p is False:
@@ -1066,30 +1228,33 @@ class AMIDR():
                 print("Pulse Labels: {}\n".format(vlabels))
 
         
-        iadj = 0
-        for i in range(nvolts):    
-            if len([j for j in fcaps[i-iadj] if j>0.001]) < 4:
-                print("{} removed due to not having 4 or more datapoints with relative change in capacity ($τ$) above 0.001".format(vlabels[i-iadj]))
-                caps.pop(i-iadj)
-                cumcaps.pop(i-iadj)
-                volts.pop(i-iadj)
-                fcaps.pop(i-iadj)
-                rates.pop(i-iadj)
-                eff_rates.pop(i-iadj)
-                currs.pop(i-iadj)
-                ir.pop(i-iadj)
-                dqdv.pop(i-iadj)
-                resistdrop.pop(i-iadj)
-                icaps = np.delete(icaps, i-iadj)
-                avg_caps = np.delete(avg_caps, i-iadj)
-                ivolts = np.delete(ivolts, i-iadj)
-                cvolts = np.delete(cvolts, i-iadj)
-                avg_volts = np.delete(avg_volts, i-iadj)
-                dvolts = np.delete(dvolts, i-iadj)
-                vlabels = np.delete(vlabels, i-iadj)
-                iadj = iadj + 1
+        keep = np.array([np.count_nonzero(np.asarray(fc) > 0.001) >= 4 for fc in fcaps], dtype = bool)
+        if not keep.all():
+            for i in np.flatnonzero(~keep):
+                print("{} removed due to not having 4 or more datapoints with relative change in capacity ($τ$) above 0.001".format(vlabels[i]))
+            caps = [c for c, k in zip(caps, keep) if k]
+            cumcaps = [c for c, k in zip(cumcaps, keep) if k]
+            volts = [v for v, k in zip(volts, keep) if k]
+            fcaps = [f for f, k in zip(fcaps, keep) if k]
+            rates = [r for r, k in zip(rates, keep) if k]
+            eff_rates = [e for e, k in zip(eff_rates, keep) if k]
+            currs = [c for c, k in zip(currs, keep) if k]
+            ir = [r for r, k in zip(ir, keep) if k]
+            dqdv = [d for d, k in zip(dqdv, keep) if k]
+            resistdrop = [r for r, k in zip(resistdrop, keep) if k]
+            icaps = icaps[keep]
+            avg_caps = avg_caps[keep]
+            ivolts = ivolts[keep]
+            cvolts = cvolts[keep]
+            avg_volts = avg_volts[keep]
+            dvolts = dvolts[keep]
+            vlabels = np.asarray(vlabels)[keep]
         nvolts = len(caps)
         
+        # Hand on every per-interval series as a contiguous float array so fits never re-convert them
+        fcaps, rates, eff_rates, currs, ir, dqdv, resistdrop = ([np.ascontiguousarray(x, dtype = float) for x in series]
+                                                               for series in (fcaps, rates, eff_rates, currs, ir, dqdv, resistdrop))
+        
         speccaps = []
         speccumcaps = []
         for i in range(nvolts):
@@ -1098,7 +1263,7 @@ class AMIDR():
 
         return speccaps, speccumcaps, volts, fcaps, rates, eff_rates, currs, ir, dqdv, resistdrop, icaps, avg_caps, ivolts, cvolts, avg_volts, dvolts, vlabels 
        
-    def plot_protocol(self, xlims = None, ylims = None, export_data = None, export_fig = True):
+    def plot_protocol(self, xlims = None, ylims = None, export_data = None, export_fig = True, show_fig = True):
         
         print("_________________________________")
         
@@ -1118,11 +1283,18 @@ class AMIDR():
         axs[1].grid(which = 'minor', color = 'lightgrey')
         #axs[0].tick_params(direction = 'in', top = True, right = True)
         
+        # Collect step curves and draw them as one collection
+        capScale = 1000/self.mass
+        sigseg = np.column_stack([self.sigdf['Capacity'].to_numpy()*capScale, self.sigdf['Label Potential'].to_numpy()])
+        segs = []
+        segcolors = []
+        labels = []
+        
         # plot signature curves first if first
         if self.sc_stepnums[0] == 1:
-            axs[1].plot(self.sigdf['Capacity']*1000/self.mass, self.sigdf['Label Potential'],
-                color = 'red',
-                label = 'Signature Curves')
+            segs.append(sigseg)
+            segcolors.append('red')
+            labels.append('Signature Curves')
         
         stepnums = self.df['Prot_step'].unique()
         #print(stepnums)
@@ -1130,11 +1302,12 @@ class AMIDR():
         #print(fullsteps)
         #print(self.sc_stepnums)
         # Need to set prop cycle
-        colors = plt.get_cmap('viridis')(np.linspace(0, 1, len(fullsteps)+1))
+        colors = VIRIDIS(np.linspace(0, 1, len(fullsteps)+1))
         c = 0
+        steps_df = self.df.groupby('Prot_step')
         for i in range(len(fullsteps)):
 
-            stepdf = self.df.loc[self.df['Prot_step'] == fullsteps[i]]
+            stepdf = steps_df.get_group(fullsteps[i])
             avgcurr = stepdf['Current'].mean()
             if avgcurr > 0.0:
                 cyclabel = 'Charge'
@@ -1145,23 +1318,25 @@ class AMIDR():
                 label = 'OCV'
             else:
                 avgcurr = np.absolute(avgcurr)
-                minarg = np.argmin(np.absolute(RATES - self.capacity/avgcurr))
-                rate = RATES[minarg]
+                rate = _nearest_rate(self.capacity/avgcurr)
                 label = 'C/{0} {1}'.format(int(rate), cyclabel)
             
-            axs[1].plot(stepdf['Capacity']*1000/self.mass, stepdf['Label Potential'],
-                        color = colors[c],
-                        label = label)
+            segs.append(np.column_stack([stepdf['Capacity'].to_numpy()*capScale, stepdf['Label Potential'].to_numpy()]))
+            segcolors.append(colors[c])
+            labels.append(label)
             
             c = c + 1
             
             # if the next step is the start of sigcurves, plot sigcurves
             if fullsteps[i] == self.sc_stepnums[0] - 1:
-                axs[1].plot(self.sigdf['Capacity']*1000/self.mass, self.sigdf['Label Potential'],
-                        color = 'red',
-                        label = 'Signature Curves')
+                segs.append(sigseg)
+                segcolors.append('red')
+                labels.append('Signature Curves')
         
-        plt.legend(bbox_to_anchor = (1.0, 0.5), loc = 'center left')
+        axs[1].add_collection(LineCollection(segs, colors = segcolors))
+        axs[1].autoscale_view()
+        handles = [Line2D([], [], color = segcolors[i], label = labels[i]) for i in range(len(segs))]
+        axs[1].legend(handles = handles, bbox_to_anchor = (1.0, 0.5), loc = 'center left')
         
         if xlims is not None:
             axs[1].set_xlim(xlims[0], xlims[1])
@@ -1171,26 +1346,32 @@ class AMIDR():
         if export_fig:
             figname = self.dst / '{} Protocol.jpg'.format(self.cell_label)
             print(figname)
-            plt.savefig(self.dst / '{} Protocol.jpg'.format(self.cell_label), bbox_inches = 'tight')
+            fig.savefig(figname, bbox_inches = 'tight')
             
-        plt.show()
-        plt.close()
+        if show_fig:
+            plt.show()
+        plt.close(fig)
         print()
     
-    def plot_caps(self, export_data = None, export_fig = True):
+    def plot_caps(self, export_data = None, export_fig = True, show_fig = True):
                 
         print("_________________________________")
         
         if not(export_data is None): print("There is no data to export. Feel free to neglect this argument.")
         
         fig, axs = plt.subplots(nrows = 2, ncols = 1, sharex = True, figsize = (3, 6), gridspec_kw = {'hspace':0.0})
-        colors = plt.get_cmap('viridis')(np.linspace(0, 1, self.nvolts))
-        
-        for i in range(self.nvolts):
-            axs[0].semilogx(self.eff_rates[i], self.cumcaps[i],
-                            color = colors[i])
-            axs[1].semilogx(self.eff_rates[i], self.fcaps[i],
-                            color = colors[i], label = self.vlabels[i])
+        colors = VIRIDIS(np.linspace(0, 1, self.nvolts))
+        
+        # Draw every voltage interval as one collection per axis
+        axs[0].add_collection(LineCollection([np.column_stack([self.eff_rates[i], self.cumcaps[i]]) for i in range(self.nvolts)],
+                                             colors = colors))
+        axs[1].add_collection(LineCollection([np.column_stack([self.eff_rates[i], self.fcaps[i]]) for i in range(self.nvolts)],
+                                             colors = colors))
+        # Set log scale after adding so data limits are taken in data coordinates
+        axs[1].set_xscale('log')
+        axs[0].autoscale_view()
+        axs[1].autoscale_view()
+        handles = [Line2D([], [], color = colors[i], label = self.vlabels[i]) for i in range(self.nvolts)]
         
         if self.single_p:
             axs[1].set_xlabel('$q_{i}/I$ (h)')
@@ -1199,21 +1380,21 @@ class AMIDR():
         axs[1].set_ylabel('$τ$')
         axs[0].set_ylabel('Specific Capacity\n(mAh g$\mathregular{^{-1}}$)')
         axs[1].tick_params(axis = 'x', length = 0)
-        axs[0].xaxis.set_minor_locator(ticker.LogLocator(subs = np.arange(1.0, 10.0) * 0.1, numticks = 10))
-        axs[0].xaxis.set_major_locator(ticker.LogLocator(numticks = 10))
+        _log_locators(axs[0].xaxis)
         axs[0].yaxis.set_minor_locator(ticker.AutoMinorLocator())
         axs[0].grid(which = 'minor', color = 'lightgrey')
         axs[1].yaxis.set_minor_locator(ticker.AutoMinorLocator())
         axs[1].grid(which = 'minor', color = 'lightgrey')
-        plt.legend(bbox_to_anchor = (1.0, 1.0), loc = 'center left', ncol = 1 + self.nvolts//25)
+        axs[1].legend(handles = handles, bbox_to_anchor = (1.0, 1.0), loc = 'center left', ncol = 1 + self.nvolts//25)
         
         if export_fig:
             figname = self.dst / '{} Parsed.jpg'.format(self.cell_label)
             print(figname)
-            plt.savefig(figname, bbox_inches = 'tight')
+            fig.savefig(figname, bbox_inches = 'tight')
 
-        plt.show()
-        plt.close()
+        if show_fig:
+            plt.show()
+        plt.close(fig)
         print()
 
     def fit_atlung(self, r, R_corr, ionsat_inputs = [], micR_input = 4.9, ftol = 5e-14, D_bounds = [1e-17, 1e-8], D_guess = 1.0e-11, 
@@ -1236,66 +1417,34 @@ class AMIDR():
             shape = 'sphere'
             
         # Get geometric constants according to particle shape.
-        if shape == 'sphere':
-            self.alphas = []
-            for i in np.arange(4, 4*nalpha):
-                g = lambda a: a/np.tan(a) - 1
-                sol = fsolve(g, i)
-                self.alphas.append(sol)
-            self.alphas = np.unique(np.around(self.alphas, 8))**2
-            self.alphas = self.alphas[:nalpha]
-            A, B = 3, 5
-
-        elif shape == 'plane':
-            self.alphas = (np.arange(1, nalpha+1)*np.pi)**2
-            A, B = 1, 3
+        self.alphas, A, B = _shape_constants(shape, nalpha)
+        self._inv_alphas = 1/self.alphas
                 
         # Solve for tau vs Q
         if self.R_corr is False:
             print("Optimum Parameters: {}".format("Log(Dc) fCapAdj"))
-            Q_arr = np.logspace(-3, 2, nQ)
-            tau_sol = np.zeros(nQ)
-            tau_guess = 0.5
-            for i in range(nQ):
-                Q = Q_arr[i]
-                func = lambda tau: tau - 1 + (1/(A*Q))*(1/B - 2*(np.sum(np.exp(-self.alphas*tau*Q)/self.alphas)))
-                tau_sol[i] = fsolve(func, tau_guess, factor = 1.)
+            Q_arr, tau_sol = _atlung_curve(shape, nalpha, nQ, -3)
         elif self.single_p is False:
             print("Optimum Parameters: {}".format("Log(Dc) fCapAdj Log(P) Log(P/Dc)"))
         else:
             print("Optimum Parameters: {}".format("Log(Dc) Log(P) Log(P/Dc)"))
                 
-        dconst = np.zeros(self.nvolts, dtype = float)
-        dtconst = np.zeros(self.nvolts, dtype = float)
-        socs = np.zeros(self.nvolts, dtype = float)
-        isocs = np.zeros(self.nvolts, dtype = float)
-        pconst = np.zeros(self.nvolts, dtype = float)
-        resist = np.zeros(self.nvolts, dtype = float)
-        dqdv = np.zeros(self.nvolts, dtype = float)
-        sigma = np.zeros(self.nvolts, dtype = float)
-        fit_err = np.zeros(self.nvolts, dtype = float)
-        cap_max = np.zeros(self.nvolts, dtype = float)
-        cap_min = np.zeros(self.nvolts, dtype = float)
-        cap_span = np.zeros(self.nvolts, dtype = float)
-        
-        socs[:] = np.nan
-        isocs[:] = np.nan
-        dtconst[:] = np.nan
+        # Per-interval results as rows of one block
+        fitvals = np.zeros((12, self.nvolts), dtype = float)
+        fitvals[1:4] = np.nan
+        dconst, dtconst, socs, isocs, pconst, resist, dqdv, sigma, fit_err, cap_max, cap_min, cap_span = fitvals
 
-        for j in range(self.nvolts):
+        if self.single_p is True:
+            # constrains fcapadj to 1
+            fcapadj_bounds = [1.0, 1.0000001]
+        
+        def fit_one(j):
             z = np.ones(len(self.fcaps[j]))
-            fcap = np.array(self.fcaps[j])
-            rates = np.array(self.eff_rates[j])
-            
-            if self.single_p is False:
-                # selects the dqdv of C/40 discharge/charge or nearest to C/40
-                act_rates = self.capacity / np.array(self.currs[j])
-                minarg = np.argmin(np.absolute(40 - act_rates))
-                dqdv[j] = self.dqdv[j][minarg]
-            else:
-                dqdv[j] = self.dqdv[j][0]
-                # constrains fcapadj to 1
-                fcapadj_bounds = [1.0, 1.0000001]
+            fcap = np.asarray(self.fcaps[j])
+            rates = np.asarray(self.eff_rates[j])
+            weights = None
+            outofbounds = False
+            Q_j, tau_j = (Q_arr, tau_sol) if self.R_corr is False else (None, None)
             
             if self.R_corr is False:
                 C = np.sum(self.ir[j])
@@ -1314,8 +1463,6 @@ class AMIDR():
                                bounds = bounds, sigma = weights,
                                method = 'trf', max_nfev = 5000, x_scale = [1.0, 1.0],
                                ftol = ftol, xtol = None, gtol = None, loss = 'soft_l1', f_scale = 1.0)
-                    with np.printoptions(precision = 4):
-                        print("{}: {}".format(self.vlabels[j], popt))
                 else:
                     p0opt = [p0[2] - p0[0], p0[1], p0[2]]
                     boundsopt = [[bounds[0][2] - bounds[1][0], bounds[0][1], bounds[0][2]], 
@@ -1326,26 +1473,10 @@ class AMIDR():
                                method = 'trf', max_nfev = 5000, x_scale = [1.0, 1.0, 1.0],
                                ftol = ftol, xtol = None, gtol = None, loss = 'soft_l1', f_scale = 1.0)
                     popt = np.array([popt[2] - popt[0], popt[1], popt[2], popt[0]])
-                    with np.printoptions(precision = 3):
-                        if self.single_p is False:
-                            print("{}: {}".format(self.vlabels[j], popt))
-                        else:
-                            if remove_out_of_bounds and (round(popt[2], 5) == round(bounds[0][2], 5) or round(popt[2], 5) == round(bounds[1][2], 5)):
-                                print("{}: {}".format(self.vlabels[j], 'No fit within P bounds'))
-                                popt = np.array([float('NaN'), float('NaN'), float('NaN'), float('NaN')])
-                            else:
-                                print("{}: {}".format(self.vlabels[j], np.array([popt[0], popt[2], popt[3]])))
-                    pconst[j] = 10**popt[2]
-                    Q_arr = np.logspace(-6, 2, nQ)
-                    tau_sol = np.zeros(nQ)
-                    tau_guess = 0.5
-                    for i in range(nQ):
-                        Q = Q_arr[i]
-                        func = lambda tau: tau - 1 + (1/(A*Q))*(1/B - 2*(np.sum(np.exp(-self.alphas*tau*Q)/self.alphas))) + 10**popt[2]/Q if 10**popt[2]<Q else tau
-
-                        tau_sol[i] = fsolve(func, tau_guess, factor = 1.)
-                        if tau_sol[i] < 0:
-                            tau_sol[i] = 0
+                    if self.single_p is True and remove_out_of_bounds and (round(popt[2], 5) == round(bounds[0][2], 5) or round(popt[2], 5) == round(bounds[1][2], 5)):
+                        outofbounds = True
+                        popt = np.array([float('NaN'), float('NaN'), float('NaN'), float('NaN')])
+                    Q_j, tau_j = _atlung_curve(shape, nalpha, nQ, -6, 10**popt[2])
                     
             if shape == 'plane':
                 popt, pcov = curve_fit(self._planes, (fcap, rates), z, p0 = p0,
@@ -1353,6 +1484,38 @@ class AMIDR():
                            method = 'trf', max_nfev = 5000, x_scale = [1e-11, 1.0],
                            ftol = ftol, xtol = None, gtol = None, loss = 'soft_l1', f_scale = 1.0)
             
+            return fcap, rates, weights, popt, pcov, outofbounds, Q_j, tau_j
+        
+        # Each voltage interval is fit independently, so run the fits on parallel threads (numpy releases the GIL in the model)
+        # and report the results in order below.
+        with ThreadPoolExecutor(max_workers = min(8, max(1, self.nvolts))) as executor:
+            fits = list(executor.map(fit_one, range(self.nvolts)))
+        
+        for j in range(self.nvolts):
+            fcap, rates, weights, popt, pcov, outofbounds, Q_arr, tau_sol = fits[j]
+            
+            if self.single_p is False:
+                # selects the dqdv of C/40 discharge/charge or nearest to C/40
+                act_rates = self.capacity / np.asarray(self.currs[j])
+                minarg = np.argmin(np.absolute(40 - act_rates))
+                dqdv[j] = self.dqdv[j][minarg]
+            else:
+                dqdv[j] = self.dqdv[j][0]
+            
+            if shape == 'sphere':
+                if self.R_corr is False:
+                    with np.printoptions(precision = 4):
+                        print("{}: {}".format(self.vlabels[j], popt))
+                else:
+                    with np.printoptions(precision = 3):
+                        if self.single_p is False:
+                            print("{}: {}".format(self.vlabels[j], popt))
+                        elif outofbounds:
+                            print("{}: {}".format(self.vlabels[j], 'No fit within P bounds'))
+                        else:
+                            print("{}: {}".format(self.vlabels[j], np.array([popt[0], popt[2], popt[3]])))
+                    pconst[j] = 10**popt[2]
+            
             sigma[j] = np.sqrt(np.diag(pcov))[0]
             dconst[j] = 10**popt[0]
             Qfit = 3600*rates*dconst[j]/r**2
@@ -1363,50 +1526,43 @@ class AMIDR():
             cap_span[j] = tau_fit[-1] - tau_fit[0]
             
             # Get difference between fitted values and theoretical Atlung curve to get fit_err.
-            error = np.zeros(len(Qfit), dtype = float)
-            for k in range(len(Qfit)):
-                dQ = np.absolute(Q_arr - Qfit[k])
-                minarg = np.argmin(dQ)
-                error[k] = np.absolute(tau_fit[k] - tau_sol[minarg])
+            error = np.absolute(tau_fit - tau_sol[_nearest_index(Q_arr, Qfit)])
             if R_corr is False:
                 fit_err[j] = np.sum(weights*error)
             else:
                 fit_err[j] = np.sqrt(np.average((error/cap_max[j])**2))
             
-            plt.figure(figsize = (3, 3))
-            plt.semilogx(Qfit, tau_fit, 'or', markersize = 2, label = 'Experimental')
-            plt.semilogx(Q_arr, tau_sol, '-k', label = 'Model')
+            fig, ax = plt.subplots(figsize = (3, 3))
+            ax.semilogx(Qfit, tau_fit, 'or', markersize = 2, label = 'Experimental')
+            ax.semilogx(Q_arr, tau_sol, '-k', label = 'Model')
             
             if max(tau_fit) < 0.01:
-                plt.ylim(0, 0.01)
+                ax.set_ylim(0, 0.01)
             elif max(tau_fit) < 0.1:
-                plt.ylim(0, 0.1)
+                ax.set_ylim(0, 0.1)
             else:
-                plt.ylim(0, 1)
+                ax.set_ylim(0, 1)
                 
-            plt.xlabel('$Q$')
-            plt.ylabel('$τ$')
-            plt.legend(loc = 'upper left', frameon = True)
+            ax.set_xlabel('$Q$')
+            ax.set_ylabel('$τ$')
+            ax.legend(loc = 'upper left', frameon = True)
             
             if Qfit[0] < 1.0e-4 or Qfit[1] < 1.0e-3:
-                plt.xlim(1.0e-6, 1.0e0)
-                plt.xticks(10.**np.arange(-6, 1))
+                ax.set_xlim(1.0e-6, 1.0e0)
             else:
-                plt.xlim(1.0e-4, 1.0e2)
-                plt.xticks(10.**np.arange(-4, 3))
+                ax.set_xlim(1.0e-4, 1.0e2)
                 
-            plt.gca().xaxis.set_minor_locator(ticker.LogLocator(subs = np.arange(1.0, 10.0) * 0.1, numticks = 10))
-            plt.gca().xaxis.set_major_locator(ticker.LogLocator(numticks = 10))
-            plt.gca().yaxis.set_minor_locator(ticker.AutoMinorLocator())
+            _log_locators(ax.xaxis)
+            ax.yaxis.set_minor_locator(ticker.AutoMinorLocator())
             
-            plt.gca().grid(which = 'minor', color = 'lightgrey')
+            ax.grid(which = 'minor', color = 'lightgrey')
             
             if export_fig:
                 figname = self.dst / '{0} {1:.3f} V ({2}).jpg'.format(cell_label, self.avg_volts[j], shape)
                 if not(np.isnan(popt[0])):
-                    plt.savefig(figname, bbox_inches = 'tight')
+                    fig.savefig(figname, bbox_inches = 'tight')
             
-            plt.close()
+            plt.close(fig)
             
         print()
             
@@ -1446,27 +1602,10 @@ class AMIDR():
                 volt1 = ionsat_inputs[3]
                 newcap2 = ionsat_inputs[4]/1000*self.mass
                 volt2 = ionsat_inputs[5]
-                volt1a = float('NaN')
-                volt1b = float('NaN')
-                volt2a = float('NaN')
-                volt2b = float('NaN')
-                
-                for i in range(len(self.ivolts)):
-                    if volt1 > self.ivolts[i] and not(volt1a > self.ivolts[i]):
-                        volt1a = self.ivolts[i]
-                        cap1a = self.icaps[i]
-                    if volt1 < self.ivolts[i] and not(volt1b < self.ivolts[i]):
-                        volt1b = self.ivolts[i]
-                        cap1b = self.icaps[i]
-                    if volt2 > self.ivolts[i] and not(volt2a > self.ivolts[i]):
-                        volt2a = self.ivolts[i]
-                        cap2a = self.icaps[i]
-                    if volt2 < self.ivolts[i] and not(volt2b < self.ivolts[i]):
-                        volt2b = self.ivolts[i]
-                        cap2b = self.icaps[i]
                 
-                cap1 = cap1a + (volt1 - volt1a)/(volt1b - volt1a)*(cap1b - cap1a)
-                cap2 = cap2a + (volt2 - volt2a)/(volt2b - volt2a)*(cap2b - cap2a)
+                # Interpolate initial capacity at both voltages between the bracketing pulses
+                order = np.argsort(self.ivolts, kind = 'stable')
+                cap1, cap2 = np.interp([volt1, volt2], np.asarray(self.ivolts)[order], np.asarray(self.icaps)[order])
                 m = (newcap2 - newcap1)/(cap2 - cap1)
                 b = newcap1 - m*cap1
                 
@@ -1508,7 +1647,7 @@ class AMIDR():
         
         return self.avg_volts, self.ivolts, dconst, dtconst, fit_err, cap_span, cap_max, cap_min, self.caps, self.ir, self.dvolts, pconst, dqdv, resist, self.resistdrop, self.single_p, self.R_corr, cell_label, self.mass, self.dst
         
-    def make_summary_graph(self, fit_data, export_data = None, export_fig = True):
+    def make_summary_graph(self, fit_data, export_data = None, export_fig = True, show_fig = True):
         
         print("_________________________________")
         
@@ -1546,8 +1685,7 @@ class AMIDR():
                 axs[0].set_xlabel('Voltage (V)')
                 axs[0].set_ylabel('$D$ (cm$\mathregular{^{2}}$ s$\mathregular{^{-1}}$)')
                 axs[0].xaxis.set_minor_locator(ticker.AutoMinorLocator())
-                axs[0].yaxis.set_minor_locator(ticker.LogLocator(subs = np.arange(1.0, 10.0) * 0.1, numticks = 10))
-                axs[0].yaxis.set_major_locator(ticker.LogLocator(numticks = 10))
+                _log_locators(axs[0].yaxis)
                 axs[0].grid(which = 'minor', color = 'lightgrey')
                 if sum(dtconst) != 0:
                     axs[0].legend(frameon = True)
@@ -1555,8 +1693,7 @@ class AMIDR():
                 axs[1].semilogy(voltage, fit_err, 'kx-')
                 axs[1].set_xlabel('Voltage (V)')
                 axs[1].set_ylabel('Fit Error')
-                axs[1].yaxis.set_minor_locator(ticker.LogLocator(subs = np.arange(1.0, 10.0) * 0.1, numticks = 10))
-                axs[1].yaxis.set_major_locator(ticker.LogLocator(numticks = 10))
+                _log_locators(axs[1].yaxis)
                 axs[1].grid(which = 'minor', color = 'lightgrey')
                 
                 axs[2].set_ylim(0, 1.0)
@@ -1566,10 +1703,8 @@ class AMIDR():
                 axs[2].yaxis.set_minor_locator(ticker.AutoMinorLocator())
                 axs[2].grid(which = 'minor', color = 'lightgrey')
                 axs[2].set_axisbelow(True)
-                for j in range(nvolts):
-                    axs[2].fill(np.array([voltage[j]-0.01, voltage[j]-0.01, voltage[j]+0.01, voltage[j]+0.01]),
-                                np.array([cap_min[j], cap_max[j], cap_max[j], cap_min[j]]),
-                                color = 'grey', edgecolor = 'k', linestyle = '-')
+                axs[2].add_collection(PolyCollection(_span_boxes(voltage, 0.01, cap_min, cap_max), facecolors = 'grey', edgecolors = 'k', linestyles = '-'))
+                axs[2].autoscale_view()
                 
                 for j in range(nvolts):
                     cap_in_step = caps[j]
@@ -1605,8 +1740,7 @@ class AMIDR():
                 axs[0].set_xlabel('Voltage (V)')
                 axs[0].set_ylabel('$D$ (cm$\mathregular{^{2}}$ s$\mathregular{^{-1}}$)')
                 axs[0].xaxis.set_minor_locator(ticker.AutoMinorLocator())
-                axs[0].yaxis.set_minor_locator(ticker.LogLocator(subs = np.arange(1.0, 10.0) * 0.1, numticks = 10))
-                axs[0].yaxis.set_major_locator(ticker.LogLocator(numticks = 10))
+                _log_locators(axs[0].yaxis)
                 axs[0].grid(which = 'minor', color = 'lightgrey')
                 if sum(dtconst) != 0:
                     axs[0].legend(frameon = True)
@@ -1620,8 +1754,7 @@ class AMIDR():
                 axs[1].errorbar(voltage, rdavg, rddev, fmt = 'k.:', capsize = 3.0, label = 'V Drop R')
                 axs[1].set_xlabel('Voltage (V)')
                 axs[1].set_ylabel('$R$ (Ω)')
-                axs[1].yaxis.set_minor_locator(ticker.LogLocator(subs = np.arange(1.0, 10.0) * 0.1, numticks = 10))
-                axs[1].yaxis.set_major_locator(ticker.LogLocator(numticks = 10))
+                _log_locators(axs[1].yaxis)
                 axs[1].grid(which = 'minor', color = 'lightgrey')
                 axs[1].legend(frameon = True)
                 
@@ -1630,16 +1763,14 @@ class AMIDR():
                 axs[2].set_ylim(2.0e-3, 0.8)
                 axs[2].set_xlabel('Voltage (V)')
                 axs[2].set_ylabel('$P$')
-                axs[2].yaxis.set_minor_locator(ticker.LogLocator(subs = np.arange(1.0, 10.0) * 0.1, numticks = 10))
-                axs[2].yaxis.set_major_locator(ticker.LogLocator(numticks = 10))
+                _log_locators(axs[2].yaxis)
                 axs[2].grid(which = 'minor', color = 'lightgrey')
                 axs[2].legend(frameon = True)
                 
                 axs[3].semilogy(voltage, fit_err, 'kx-')
                 axs[3].set_xlabel('Voltage (V)')
                 axs[3].set_ylabel('Fit Error')
-                axs[3].yaxis.set_minor_locator(ticker.LogLocator(subs = np.arange(1.0, 10.0) * 0.1, numticks = 10))
-                axs[3].yaxis.set_major_locator(ticker.LogLocator(numticks = 10))
+                _log_locators(axs[3].yaxis)
                 axs[3].grid(which = 'minor', color = 'lightgrey')
                 
                 axs[4].set_ylim(0, 1.0)
@@ -1649,10 +1780,8 @@ class AMIDR():
                 axs[4].yaxis.set_minor_locator(ticker.AutoMinorLocator())
                 axs[4].grid(which = 'minor', color = 'lightgrey')
                 axs[4].set_axisbelow(True)
-                for j in range(nvolts):
-                    axs[4].fill(np.array([voltage[j]-0.01, voltage[j]-0.01, voltage[j]+0.01, voltage[j]+0.01]),
-                                np.array([cap_min[j], cap_max[j], cap_max[j], cap_min[j]]),
-                                color = 'grey', edgecolor = 'k', linestyle = '-')
+                axs[4].add_collection(PolyCollection(_span_boxes(voltage, 0.01, cap_min, cap_max), facecolors = 'grey', edgecolors = 'k', linestyles = '-'))
+                axs[4].autoscale_view()
                 
                 for j in range(nvolts):
                     cap_in_step = caps[j]
@@ -1680,8 +1809,7 @@ class AMIDR():
             axs[0].set_xlabel('Voltage (V)')
             axs[0].set_ylabel('$D$ (cm$\mathregular{^{2}}$ s$\mathregular{^{-1}}$)')
             axs[0].xaxis.set_minor_locator(ticker.AutoMinorLocator())
-            axs[0].yaxis.set_minor_locator(ticker.LogLocator(subs = np.arange(1.0, 10.0) * 0.1, numticks = 10))
-            axs[0].yaxis.set_major_locator(ticker.LogLocator(numticks = 10))
+            _log_locators(axs[0].yaxis)
             axs[0].grid(which = 'minor', color = 'lightgrey')
             if sum(dtconst) != 0:
                 axs[0].legend(frameon = True)
@@ -1690,8 +1818,7 @@ class AMIDR():
             axs[1].semilogy(ivoltage, resistdrop, 'k.:', label = 'V Drop R')
             axs[1].set_xlabel('Voltage (V)')
             axs[1].set_ylabel('$R$ (Ω)')
-            axs[1].yaxis.set_minor_locator(ticker.LogLocator(subs = np.arange(1.0, 10.0) * 0.1, numticks = 10))
-            axs[1].yaxis.set_major_locator(ticker.LogLocator(numticks = 10))
+            _log_locators(axs[1].yaxis)
             axs[1].grid(which = 'minor', color = 'lightgrey')
             axs[1].legend(frameon = True)
             
@@ -1700,16 +1827,14 @@ class AMIDR():
             axs[2].set_ylim(2.0e-3, 0.8)
             axs[2].set_xlabel('Voltage (V)')
             axs[2].set_ylabel('$P$')
-            axs[2].yaxis.set_minor_locator(ticker.LogLocator(subs = np.arange(1.0, 10.0) * 0.1, numticks = 10))
-            axs[2].yaxis.set_major_locator(ticker.LogLocator(numticks = 10))
+            _log_locators(axs[2].yaxis)
             axs[2].grid(which = 'minor', color = 'lightgrey')
             axs[2].legend(frameon = True)
             
             axs[3].semilogy(voltage, fit_err, 'kx-')
             axs[3].set_xlabel('Voltage (V)')
             axs[3].set_ylabel('Fit Error')
-            axs[3].yaxis.set_minor_locator(ticker.LogLocator(subs = np.arange(1.0, 10.0) * 0.1, numticks = 10))
-            axs[3].yaxis.set_major_locator(ticker.LogLocator(numticks = 10))
+            _log_locators(axs[3].yaxis)
             axs[3].grid(which = 'minor', color = 'lightgrey')
             
             axs[4].set_ylim(0, 1.0)
@@ -1719,12 +1844,10 @@ class AMIDR():
             axs[4].yaxis.set_minor_locator(ticker.AutoMinorLocator())
             axs[4].grid(which = 'minor', color = 'lightgrey')
             axs[4].set_axisbelow(True)
-            for j in range(nvolts):
-                axs[4].fill(np.array([voltage[j]-dvolts[j]/2, voltage[j]-dvolts[j]/2, voltage[j]+dvolts[j]/2, voltage[j]+dvolts[j]/2]),
-                            np.array([cap_min[j], cap_max[j], cap_max[j], cap_min[j]]),
-                            color = 'grey', edgecolor = 'k', linestyle = '-')
+            axs[4].add_collection(PolyCollection(_span_boxes(voltage, np.asarray(dvolts)/2, cap_min, cap_max), facecolors = 'grey', edgecolors = 'k', linestyles = '-'))
+            axs[4].autoscale_view()
             
-            axs[5].plot(voltage, [i*1000/mass for i in dqdv], 'kx-')
+            axs[5].plot(voltage, np.asarray(dqdv)*1000/mass, 'kx-')
             axs[5].set_xlabel('Voltage (V)')
             axs[5].set_ylabel('$dq/dV$\n(mAh g$\mathregular{^{-1}}$ V$\mathregular{^{-1}}$)')
             axs[5].yaxis.set_minor_locator(ticker.AutoMinorLocator())
@@ -1733,10 +1856,11 @@ class AMIDR():
         if export_fig:
             figname = dst / '{0} Summary.jpg'.format(cell_label)
             print(figname)
-            plt.savefig(figname, bbox_inches = 'tight')
+            fig.savefig(figname, bbox_inches = 'tight')
             
-        plt.show()
-        plt.close()
+        if show_fig:
+            plt.show()
+        plt.close(fig)
         print()
 
     def _spheres(self, X, logD, c_max):
@@ -1744,11 +1868,11 @@ class AMIDR():
         D = 10**logD
         
         c, n = X
-        carr = np.repeat(c.reshape(len(c), 1), len(self.alphas), axis = 1)
-        narr = np.repeat(n.reshape(len(n), 1), len(self.alphas), axis = 1)
-        a = np.repeat(self.alphas.reshape(1, len(self.alphas)), np.shape(carr)[0], axis = 0)
+        Q = 3600*n*D/self.r**2
+        # One exp table of points down the rows against alphas along the columns, reduced over alphas with a BLAS product
+        E = _exp_table((c/c_max)*Q, self.alphas)
         
-        return c/c_max + ((self.r**2)/(3*3600*n*D))*(1/5 - 2*(np.sum(np.exp(-a*(carr/c_max)*3600*narr*D/self.r**2)/a, axis = 1)))
+        return c/c_max + (1/(3*Q))*(1/5 - 2*(E @ self._inv_alphas))
     
     def _spheres_R_corr(self, X, logPDivD, c_max, logP):
         
@@ -1756,33 +1880,27 @@ class AMIDR():
         P = 10**logP
         
         c, n = X
-        carr = np.repeat(c.reshape(len(c), 1), len(self.alphas), axis = 1)
-        narr = np.repeat(n.reshape(len(n), 1), len(self.alphas), axis = 1)
-        a = np.repeat(self.alphas.reshape(1, len(self.alphas)), np.shape(carr)[0], axis = 0)
+        Q = 3600*n*D/self.r**2
+        E = _exp_table((c/c_max)*Q, self.alphas)
         
         # Calculates inacessible capacity as 1 + tau if P/Q > 1 AND fcap is less than 0.05 of the largest fcap 
         # by setting n so that P = Q. Otherwise standard AMIDR equation.
         # This avoids the divergent region where tau = 0 but infinite summation error is amplified. 
-        result = []
-        for i in range(len(c)):
-            if P>(3600*n[i]*D)/self.r**2 and c[i]/max(c) < 0.05:
-                result.append(c[i]/c_max + 1)
-            else:
-                result.append(c[i]/c_max + ((self.r**2)/(3*3600*n[i]*D))*(1/5 - 2*(np.sum(np.exp(-a[i]*(carr[i]/c_max)*3600*narr[i]*D/self.r**2)/a[i]))) + P*self.r**2/(3600*n[i]*D))
+        inaccessible = (P > Q) & (c/c.max() < 0.05)
+        result = c/c_max + (1/(3*Q))*(1/5 - 2*(E @ self._inv_alphas)) + P/Q
         
         #return c/c_max + ((self.r**2)/(3*3600*n*D))*(1/5 - 2*(np.sum(np.exp(-a*(carr/c_max)*3600*narr*D/self.r**2)/a, axis = 1))) + self._dqdv*I*P/self._max_cap
-        return result
+        return np.where(inaccessible, c/c_max + 1, result)
     
     def _planes(self, X, logD, c_max):
         
         D = 10**logD
         
         c, n = X
-        carr = np.repeat(c.reshape(len(c), 1), len(self.alphas), axis = 1)
-        narr = np.repeat(n.reshape(len(c), 1), len(self.alphas), axis = 1)
-        a = np.repeat(self.alphas.reshape(1, len(self.alphas)), np.shape(carr)[0], axis = 0)
+        Q = 3600*n*D/self.r**2
+        E = _exp_table((c/c_max)*Q, self.alphas)
         
-        return c/c_max + ((self.r**2)/(3600*n*D))*(1/3 - 2*(np.sum(np.exp(-a*(carr/c_max)*3600*narr*D/self.r**2)/a, axis = 1)))
+        return c/c_max + (1/Q)*(1/3 - 2*(E @ self._inv_alphas))
     
     def insert_rate_cap(self, rate_cap):
 
@@ -1798,7 +1916,7 @@ class AMIDR():
         
 class BINAVERAGE():
     
-    def __init__(self, path, cells, matname, binsize = 0.025, mincap = 0.5, maxdqdVchange = 2, export_data = True, export_fig = True, parselabel = None, fitlabel = None):
+    def __init__(self, path, cells, matname, binsize = 0.025, mincap = 0.5, maxdqdVchange = 2, export_data = True, export_fig = True, parselabel = None, fitlabel = None, show_fig = True):
         
         print("_________________________________")
         
@@ -1824,390 +1942,212 @@ class BINAVERAGE():
         dfC = pd.DataFrame({'Voltage (V)': [], 'Initial Voltage (V)': [], 'SOC': [], 'Initial SOC': [], 'Dc (cm^2/s)': [], 'Dt* (cm^2/s)': [], 'P' : [],
                             'dq/dV (mAh/gV)': [], 'Rfit (Ohm)' : [], 'micR (Ohmcm^2)' : [], 'Rdrop (Ohm)' : [], 'Cap Span' : [], 'Fit Error' : []})
         
-        # Generate plot for individual cells
-        fig, axs = plt.subplots(ncols = 2, nrows = 3, figsize = (6, 7.5), sharex = 'col', sharey = 'row',
-        gridspec_kw = {'height_ratios': [2, 2, 1], 'hspace': 0.0, 'width_ratios': [1, 1], 'wspace': 0.0})
-                
-        # Find and read file data into dataframes
-        for cell in cells:
-            cellpath = Path(path) / cell
-            for halfcyclepath in sorted(cellpath.iterdir(), reverse = True):
-                if halfcyclepath.is_dir():
-                    for fitfile in halfcyclepath.iterdir():
-                        if fitfile.is_file() and 'harge' + plabel + flabel + ' Fitted' in str(fitfile):
-                            if 'Discharge' in str(fitfile):
-                                print("Found discharge data for cell {}".format(Path(cellpath).name))
-                                halfcycle = 'Discharge'
-                            elif 'Charge' in str(fitfile):
-                                print("Found charge data for cell {}".format(Path(cellpath).name))
-                                halfcycle = 'Charge'
-                            else:
-                                print("Found mislabeled fit file. Fit files should designate whether they contain charge or discharge data")
-                                halfcycle = ''
-                            dfnew = pd.read_excel(fitfile)
-                            
-                            # Remove datapoints where 
-                            # dq/dV change between subsequent datapoint is greater than the max dqdV factor or
-                            # the capacity span is less the minimum capacity span.
-                            if maxdqdVchange == False:
-                                baddqdv = dfnew['dq/dV (mAh/gV)']/dfnew['dq/dV (mAh/gV)'] < 0
-                            else:
-                                baddqdv = ~(((dfnew/dfnew.set_index(dfnew.index + 1))['dq/dV (mAh/gV)'] < maxdqdVchange) & \
-                                            ((dfnew/dfnew.set_index(dfnew.index + 1))['dq/dV (mAh/gV)'] > 0) & \
-                                            ((dfnew/dfnew.set_index(dfnew.index - 1))['dq/dV (mAh/gV)'] < maxdqdVchange) & \
-                                            ((dfnew/dfnew.set_index(dfnew.index - 1))['dq/dV (mAh/gV)'] > 0) & \
-                                            ((dfnew.set_index(dfnew.index + 1)/dfnew)['dq/dV (mAh/gV)'] < maxdqdVchange) & \
-                                            ((dfnew.set_index(dfnew.index + 1)/dfnew)['dq/dV (mAh/gV)'] > 0) & \
-                                            ((dfnew.set_index(dfnew.index - 1)/dfnew)['dq/dV (mAh/gV)'] < maxdqdVchange) & \
-                                            ((dfnew.set_index(dfnew.index - 1)/dfnew)['dq/dV (mAh/gV)'] > 0))[1:-1]
-                            if mincap == False:
-                                badcapspan = dfnew['Cap Span']/dfnew['Cap Span'] < 0
-                            else:
-                                badcapspan = ~(dfnew['Cap Span'] > mincap)
-                            keep = ~(baddqdv|badcapspan)
-                            
-                            # Save good fits
-                            df = pd.concat([df, dfnew[keep]], ignore_index = True)
-                            if halfcycle == 'Discharge':
-                                dfD = pd.concat([dfD, dfnew[keep]], ignore_index = True)
-                                markerA = 'rx-'
-                                markerB = 'r.:'
-                                color = 'lightcoral'
-                            elif halfcycle == 'Charge':
-                                dfC = pd.concat([dfC, dfnew[keep]], ignore_index = True)
-                                markerA = 'bx-'
-                                markerB = 'b.:'
-                                color = 'cornflowerblue'
-                            else:
-                                markerA = 'kx-'
-                                markerB = 'k.:'
-                                color = 'grey'
-                            
-                            # Plot individual cells with outliers removed
-                            axs[0, 0].semilogy(dfnew[keep]['Voltage (V)'], dfnew[keep]['Dc (cm^2/s)'], markerA, markersize = 3)
-                            axs[0, 0].semilogy(dfnew[keep]['Voltage (V)'], dfnew[keep]['Dt* (cm^2/s)'], markerB, markersize = 1.5)                            
-                            axs[0, 1].semilogy(dfnew[keep]['SOC'], dfnew[keep]['Dc (cm^2/s)'], markerA, markersize = 3)
-                            axs[0, 1].semilogy(dfnew[keep]['SOC'], dfnew[keep]['Dt* (cm^2/s)'], markerB, markersize = 1.5)
-                            axs[1, 0].semilogy(dfnew[keep]['Initial Voltage (V)'], dfnew[keep]['micR (Ohmcm^2)'], markerA, markersize = 3)
-                            axs[1, 1].semilogy(dfnew[keep]['Initial SOC'], dfnew[keep]['micR (Ohmcm^2)'], markerA, markersize = 3)
-                            axs[2, 0].semilogy(dfnew[keep]['Initial Voltage (V)'], dfnew[keep]['dq/dV (mAh/gV)'], markerA, markersize = 3)
-                            axs[2, 1].semilogy(dfnew[keep]['Initial SOC'], dfnew[keep]['dq/dV (mAh/gV)'], markerA, markersize = 3)
-                            
-                            # Plot individual cell outliers (dqdv)
-                            axs[0, 0].semilogy(dfnew[baddqdv]['Voltage (V)'], dfnew[baddqdv]['Dc (cm^2/s)'], marker = '4', color = color, linestyle = 'None', markersize = 3)
-                            #axs[0, 0].semilogy(dfnew[baddqdv]['Voltage (V)'], dfnew[baddqdv]['Dt* (cm^2/s)'], marker = '4', color = color, linestyle = 'None', markersize = 3)                            
-                            axs[0, 1].semilogy(dfnew[baddqdv]['SOC'], dfnew[baddqdv]['Dc (cm^2/s)'], marker = '4', color = color, linestyle = 'None', markersize = 3)
-                            #axs[0, 1].semilogy(dfnew[baddqdv]['SOC'], dfnew[baddqdv]['Dt* (cm^2/s)'], marker = '4', color = color, linestyle = 'None', markersize = 3)
-                            axs[1, 0].semilogy(dfnew[baddqdv]['Initial Voltage (V)'], dfnew[baddqdv]['micR (Ohmcm^2)'], marker = '4', color = color, linestyle = 'None', markersize = 3)
-                            axs[1, 1].semilogy(dfnew[baddqdv]['Initial SOC'], dfnew[baddqdv]['micR (Ohmcm^2)'], marker = '4', color = color, linestyle = 'None', markersize = 3)
-                            axs[2, 0].semilogy(dfnew[baddqdv]['Initial Voltage (V)'], dfnew[baddqdv]['dq/dV (mAh/gV)'], marker = '4', color = color, linestyle = 'None', markersize = 3)
-                            axs[2, 1].semilogy(dfnew[baddqdv]['Initial SOC'], dfnew[baddqdv]['dq/dV (mAh/gV)'], marker = '4', color = color, linestyle = 'None', markersize = 3)
-        
-                            # Plot individual cell outliers (capspan)
-                            axs[0, 0].semilogy(dfnew[badcapspan]['Voltage (V)'], dfnew[badcapspan]['Dc (cm^2/s)'], marker = '3', color = color, linestyle = 'None', markersize = 3)
-                            #axs[0, 0].semilogy(dfnew[badcapspan]['Voltage (V)'], dfnew[badcapspan]['Dt* (cm^2/s)'], marker = '3', color = color, linestyle = 'None', markersize = 3)                            
-                            axs[0, 1].semilogy(dfnew[badcapspan]['SOC'], dfnew[badcapspan]['Dc (cm^2/s)'], marker = '3', color = color, linestyle = 'None', markersize = 3)
-                            #axs[0, 1].semilogy(dfnew[badcapspan]['SOC'], dfnew[badcapspan]['Dt* (cm^2/s)'], marker = '3', color = color, linestyle = 'None', markersize = 3)
-                            axs[1, 0].semilogy(dfnew[badcapspan]['Initial Voltage (V)'], dfnew[badcapspan]['micR (Ohmcm^2)'], marker = '3', color = color, linestyle = 'None', markersize = 3)
-                            axs[1, 1].semilogy(dfnew[badcapspan]['Initial SOC'], dfnew[badcapspan]['micR (Ohmcm^2)'], marker = '3', color = color, linestyle = 'None', markersize = 3)
-                            axs[2, 0].semilogy(dfnew[badcapspan]['Initial Voltage (V)'], dfnew[badcapspan]['dq/dV (mAh/gV)'], marker = '3', color = color, linestyle = 'None', markersize = 3)
-                            axs[2, 1].semilogy(dfnew[badcapspan]['Initial SOC'], dfnew[badcapspan]['dq/dV (mAh/gV)'], marker = '3', color = color, linestyle = 'None', markersize = 3)
-                            
-                            # Create data files
-                            if export_data:
-                                filepath = folder / '{0} {1} {2}{3}{4} Filtered.xlsx'.format(cell, matname, halfcycle, plabel, flabel)
-                                
-                                print("Filtered data exporting to:\n" + str(filepath) + "\n")
-                                
-                                writer = pd.ExcelWriter(filepath)
-                                dfnew[keep].to_excel(writer, index = False)
-                                writer.save()
-                                writer.close()
-        
-        axs[0, 0].set_ylabel('$D$ (cm$\mathregular{^{2}}$ s$\mathregular{^{-1}}$)')
-        axs[1, 0].set_ylabel('Max $ρ_{c}$ (Ω cm$\mathregular{^{2}}$)')
-        axs[2, 0].set_ylabel('$dq/dV$\n(mAh g$\mathregular{^{-1}}$ V$\mathregular{^{-1}}$)')
-        axs[2, 0].set_xlabel('Voltage (V)')
-        axs[2, 1].set_xlabel('Ion Saturation')
-        
-        axs[0, 0].semilogy([], [], 'rx-', label = 'Dch $D_{c}$')
-        axs[0, 0].semilogy([], [], 'bx-', label = 'Ch $D_{c}$')
-        axs[0, 0].semilogy([], [], 'r.:', label = 'Dch $D_{t}^{*}$')
-        axs[0, 0].semilogy([], [], 'b.:', label = 'Ch $D_{t}^{*}$')
-        axs[0, 0].legend(frameon = True, ncol = 2)
-        
-        axs[0, 1].semilogy([], [], marker = '4', color = 'grey', linestyle = 'None', label = '$Δdq/dV$ > ' + str(maxdqdVchange) + ' ($D_{c}$)')
-        axs[0, 1].semilogy([], [], marker = '3', color = 'grey', linestyle = 'None', label = 'Max $τ$ < ' + str(mincap) + ' ($D_{c}$)')
-        axs[0, 1].legend(frameon = True)
-        axs[0, 1].invert_xaxis()
-        
-        axs[1, 0].semilogy([], [], 'rx-', label = 'Dch')
-        axs[1, 0].semilogy([], [], 'bx-', label = 'Ch')
-        axs[1, 0].legend(frameon = True)
-        
-        axs[1, 1].semilogy([], [], marker = '4', color = 'grey', linestyle = 'None', label = '$Δdq/dV$ > ' + str(maxdqdVchange) + ' ($D_{c}$)')
-        axs[1, 1].semilogy([], [], marker = '3', color = 'grey', linestyle = 'None', label = 'Max $τ$ < ' + str(mincap) + ' ($D_{c}$)')
-        axs[1, 1].legend(frameon = True)
-        
-        axs[0, 0].xaxis.set_minor_locator(ticker.AutoMinorLocator())
-        axs[0, 0].yaxis.set_minor_locator(ticker.LogLocator(subs = np.arange(1.0, 10.0) * 0.1, numticks = 10))
-        axs[0, 0].yaxis.set_major_locator(ticker.LogLocator(numticks = 10))
-        axs[0, 1].xaxis.set_minor_locator(ticker.AutoMinorLocator())
-        axs[1, 0].yaxis.set_minor_locator(ticker.LogLocator(subs = np.arange(1.0, 10.0) * 0.1, numticks = 10))
-        axs[1, 0].yaxis.set_major_locator(ticker.LogLocator(numticks = 10))
+        # Generate plot for individual cells, with dq/dV also on a log scale
+        fig, axs = _binned_figure()
+        axs[2, 0].set_yscale('log')
         axs[2, 0].yaxis.set_minor_locator(ticker.AutoMinorLocator())
+                
+        # Find fit files in the half cycle folders of each cell, taking folders in reverse name order and files in folder order
+        pattern = '*/*harge' + glob.escape(plabel + flabel) + ' Fitted*'
+        fitfiles = [(cell, fitfile) for cell in cells
+                    for fitfile in sorted((Path(path) / cell).glob(pattern), key = lambda f: f.parent.name, reverse = True) if fitfile.is_file()]
+        
+        # Read the fit files concurrently, then filter and plot them in order
+        goodfits, goodD, goodC = [], [], []
+        with ThreadPoolExecutor(max_workers = min(8, max(1, len(fitfiles)))) as pool:
+            reads = [pool.submit(_read_fit, str(fitfile), fitfile.stat().st_mtime_ns) for cell, fitfile in fitfiles]
+            for (cell, fitfile), read in zip(fitfiles, reads):
+                cellpath = Path(path) / cell
+                if 'Discharge' in str(fitfile):
+                    print("Found discharge data for cell {}".format(cellpath.name))
+                    halfcycle = 'Discharge'
+                elif 'Charge' in str(fitfile):
+                    print("Found charge data for cell {}".format(cellpath.name))
+                    halfcycle = 'Charge'
+                else:
+                    print("Found mislabeled fit file. Fit files should designate whether they contain charge or discharge data")
+                    halfcycle = ''
+                dfnew = read.result().copy()
+                
+                # Remove datapoints where 
+                # dq/dV change between subsequent datapoint is greater than the max dqdV factor or
+                # the capacity span is less the minimum capacity span.
+                if maxdqdVchange == False:
+                    baddqdv = dfnew['dq/dV (mAh/gV)']/dfnew['dq/dV (mAh/gV)'] < 0
+                else:
+                    # Ratios of each dq/dV to its neighbours in both directions must all be positive and below the max factor.
+                    # The first and last points have a missing neighbour and are always removed.
+                    dqdv = dfnew['dq/dV (mAh/gV)'].to_numpy()
+                    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                        up = dqdv[1:]/dqdv[:-1]
+                        down = dqdv[:-1]/dqdv[1:]
+                    steady = (up < maxdqdVchange) & (up > 0) & (down < maxdqdVchange) & (down > 0)
+                    good = np.zeros(len(dqdv), dtype = bool)
+                    good[1:-1] = steady[:-1] & steady[1:]
+                    baddqdv = pd.Series(~good, index = dfnew.index)
+                if mincap == False:
+                    badcapspan = dfnew['Cap Span']/dfnew['Cap Span'] < 0
+                else:
+                    badcapspan = ~(dfnew['Cap Span'] > mincap)
+                keep = ~(baddqdv|badcapspan)
+                dfkeep = dfnew[keep]
+                dfdqdv = dfnew[baddqdv]
+                dfcapspan = dfnew[badcapspan]
+                
+                # Save good fits
+                goodfits.append(dfkeep)
+                if halfcycle == 'Discharge':
+                    goodD.append(dfkeep)
+                    markerA = 'rx-'
+                    markerB = 'r.:'
+                    color = 'lightcoral'
+                elif halfcycle == 'Charge':
+                    goodC.append(dfkeep)
+                    markerA = 'bx-'
+                    markerB = 'b.:'
+                    color = 'cornflowerblue'
+                else:
+                    markerA = 'kx-'
+                    markerB = 'k.:'
+                    color = 'grey'
+                
+                # Plot individual cells with outliers removed
+                axs[0, 0].plot(dfkeep['Voltage (V)'], dfkeep['Dc (cm^2/s)'], markerA, markersize = 3)
+                axs[0, 0].plot(dfkeep['Voltage (V)'], dfkeep['Dt* (cm^2/s)'], markerB, markersize = 1.5)                            
+                axs[0, 1].plot(dfkeep['SOC'], dfkeep['Dc (cm^2/s)'], markerA, markersize = 3)
+                axs[0, 1].plot(dfkeep['SOC'], dfkeep['Dt* (cm^2/s)'], markerB, markersize = 1.5)
+                axs[1, 0].plot(dfkeep['Initial Voltage (V)'], dfkeep['micR (Ohmcm^2)'], markerA, markersize = 3)
+                axs[1, 1].plot(dfkeep['Initial SOC'], dfkeep['micR (Ohmcm^2)'], markerA, markersize = 3)
+                axs[2, 0].plot(dfkeep['Initial Voltage (V)'], dfkeep['dq/dV (mAh/gV)'], markerA, markersize = 3)
+                axs[2, 1].plot(dfkeep['Initial SOC'], dfkeep['dq/dV (mAh/gV)'], markerA, markersize = 3)
+                
+                # Plot individual cell outliers (dqdv)
+                axs[0, 0].plot(dfdqdv['Voltage (V)'], dfdqdv['Dc (cm^2/s)'], marker = '4', color = color, linestyle = 'None', markersize = 3)
+                #axs[0, 0].plot(dfdqdv['Voltage (V)'], dfdqdv['Dt* (cm^2/s)'], marker = '4', color = color, linestyle = 'None', markersize = 3)                            
+                axs[0, 1].plot(dfdqdv['SOC'], dfdqdv['Dc (cm^2/s)'], marker = '4', color = color, linestyle = 'None', markersize = 3)
+                #axs[0, 1].plot(dfdqdv['SOC'], dfdqdv['Dt* (cm^2/s)'], marker = '4', color = color, linestyle = 'None', markersize = 3)
+                axs[1, 0].plot(dfdqdv['Initial Voltage (V)'], dfdqdv['micR (Ohmcm^2)'], marker = '4', color = color, linestyle = 'None', markersize = 3)
+                axs[1, 1].plot(dfdqdv['Initial SOC'], dfdqdv['micR (Ohmcm^2)'], marker = '4', color = color, linestyle = 'None', markersize = 3)
+                axs[2, 0].plot(dfdqdv['Initial Voltage (V)'], dfdqdv['dq/dV (mAh/gV)'], marker = '4', color = color, linestyle = 'None', markersize = 3)
+                axs[2, 1].plot(dfdqdv['Initial SOC'], dfdqdv['dq/dV (mAh/gV)'], marker = '4', color = color, linestyle = 'None', markersize = 3)
+
+                # Plot individual cell outliers (capspan)
+                axs[0, 0].plot(dfcapspan['Voltage (V)'], dfcapspan['Dc (cm^2/s)'], marker = '3', color = color, linestyle = 'None', markersize = 3)
+                #axs[0, 0].plot(dfcapspan['Voltage (V)'], dfcapspan['Dt* (cm^2/s)'], marker = '3', color = color, linestyle = 'None', markersize = 3)                            
+                axs[0, 1].plot(dfcapspan['SOC'], dfcapspan['Dc (cm^2/s)'], marker = '3', color = color, linestyle = 'None', markersize = 3)
+                #axs[0, 1].plot(dfcapspan['SOC'], dfcapspan['Dt* (cm^2/s)'], marker = '3', color = color, linestyle = 'None', markersize = 3)
+                axs[1, 0].plot(dfcapspan['Initial Voltage (V)'], dfcapspan['micR (Ohmcm^2)'], marker = '3', color = color, linestyle = 'None', markersize = 3)
+                axs[1, 1].plot(dfcapspan['Initial SOC'], dfcapspan['micR (Ohmcm^2)'], marker = '3', color = color, linestyle = 'None', markersize = 3)
+                axs[2, 0].plot(dfcapspan['Initial Voltage (V)'], dfcapspan['dq/dV (mAh/gV)'], marker = '3', color = color, linestyle = 'None', markersize = 3)
+                axs[2, 1].plot(dfcapspan['Initial SOC'], dfcapspan['dq/dV (mAh/gV)'], marker = '3', color = color, linestyle = 'None', markersize = 3)
+                
+                # Create data files
+                if export_data:
+                    filepath = folder / '{0} {1} {2}{3}{4} Filtered.xlsx'.format(cell, matname, halfcycle, plabel, flabel)
+                    
+                    print("Filtered data exporting to:\n" + str(filepath) + "\n")
+                    
+                    with pd.ExcelWriter(filepath) as writer:
+                        dfkeep.to_excel(writer, index = False)
+        
+        # Combine good fits from all cells
+        df = pd.concat([df] + goodfits, ignore_index = True)
+        dfD = pd.concat([dfD] + goodD, ignore_index = True)
+        dfC = pd.concat([dfC] + goodC, ignore_index = True)
+
+        outliers = [Line2D([], [], marker = '4', color = 'grey', linestyle = 'None', label = '$Δdq/dV$ > ' + str(maxdqdVchange) + ' ($D_{c}$)'),
+                    Line2D([], [], marker = '3', color = 'grey', linestyle = 'None', label = 'Max $τ$ < ' + str(mincap) + ' ($D_{c}$)')]
         
-        axs[0, 0].grid(which = 'minor', color = 'lightgrey')
-        axs[0, 1].grid(which = 'minor', color = 'lightgrey')
-        axs[1, 0].grid(which = 'minor', color = 'lightgrey')
-        axs[1, 1].grid(which = 'minor', color = 'lightgrey')
-        axs[2, 0].grid(which = 'minor', color = 'lightgrey')
-        axs[2, 1].grid(which = 'minor', color = 'lightgrey')
+        axs[0, 0].legend(handles = [Line2D([], [], color = 'r', marker = 'x', label = 'Dch $D_{c}$'),
+                                    Line2D([], [], color = 'b', marker = 'x', label = 'Ch $D_{c}$'),
+                                    Line2D([], [], color = 'r', marker = '.', linestyle = ':', label = 'Dch $D_{t}^{*}$'),
+                                    Line2D([], [], color = 'b', marker = '.', linestyle = ':', label = 'Ch $D_{t}^{*}$')], frameon = True, ncol = 2)
+        
+        axs[0, 1].legend(handles = outliers, frameon = True)
+        
+        axs[1, 0].legend(handles = [Line2D([], [], color = 'r', marker = 'x', label = 'Dch'),
+                                    Line2D([], [], color = 'b', marker = 'x', label = 'Ch')], frameon = True)
+        
+        axs[1, 1].legend(handles = outliers, frameon = True)
         
         if export_fig:
             figname = folder / '{0}{1}{2} Individual Cells.jpg'.format(matname, plabel, flabel)
             print(figname)
-            plt.savefig(figname, bbox_inches = 'tight')
+            fig.savefig(figname, bbox_inches = 'tight')
             
-        plt.show()
-        plt.close()
+        if show_fig:
+            plt.show()
+        plt.close(fig)
         print()
         
         # Establish bins and output dataframes
-        firstbinnum = int(min(min(df['Voltage (V)']), min(df['Initial Voltage (V)']))//binsize)
-        lastbinnum = int(max(max(df['Voltage (V)']), max(df['Initial Voltage (V)']))//binsize)
+        firstbinnum = int(min(df['Voltage (V)'].min(), df['Initial Voltage (V)'].min())//binsize)
+        lastbinnum = int(max(df['Voltage (V)'].max(), df['Initial Voltage (V)'].max())//binsize)
 
-        dfO = pd.DataFrame({'Voltage (V)': np.linspace(firstbinnum*binsize, lastbinnum*binsize, abs(firstbinnum - lastbinnum) + 1) + binsize/2})
-        dfOD = pd.DataFrame({'Voltage (V)': np.linspace(firstbinnum*binsize, lastbinnum*binsize, abs(firstbinnum - lastbinnum) + 1) + binsize/2})
-        dfOC = pd.DataFrame({'Voltage (V)': np.linspace(firstbinnum*binsize, lastbinnum*binsize, abs(firstbinnum - lastbinnum) + 1) + binsize/2})
+        centers = np.arange(firstbinnum, lastbinnum + 1)*binsize + binsize/2
 
         # Fill output dataframes
-        for i in dfO.index:
-            
-            # Select data points with voltages within the bin
-            binSel = (df['Voltage (V)'] >= dfO['Voltage (V)'][i] - binsize/2) & \
-                     (df['Voltage (V)'] < dfO['Voltage (V)'][i] + binsize/2)
-            binSelD = (dfD['Voltage (V)'] >= dfO['Voltage (V)'][i] - binsize/2) & \
-                      (dfD['Voltage (V)'] < dfO['Voltage (V)'][i] + binsize/2)
-            binSelC = (dfC['Voltage (V)'] >= dfO['Voltage (V)'][i] - binsize/2) & \
-                      (dfC['Voltage (V)'] < dfO['Voltage (V)'][i] + binsize/2)
-                     
-            # Select data points with initial voltages within the bin (for resistances which are plotted at initial cap)
-            ibinSel = (df['Initial Voltage (V)'] >= dfO['Voltage (V)'][i] - binsize/2) & \
-                      (df['Initial Voltage (V)'] < dfO['Voltage (V)'][i] + binsize/2)
-            ibinSelD = (dfD['Initial Voltage (V)'] >= dfO['Voltage (V)'][i] - binsize/2) & \
-                       (dfD['Initial Voltage (V)'] < dfO['Voltage (V)'][i] + binsize/2)
-            ibinSelC = (dfC['Initial Voltage (V)'] >= dfO['Voltage (V)'][i] - binsize/2) & \
-                       (dfC['Initial Voltage (V)'] < dfO['Voltage (V)'][i] + binsize/2)
-            
-            # Calculate geometric mean and standard deviation for diffusivities and resistances
-            dfO.loc[i, 'Dc (cm^2/s)'] = np.exp(np.log(df['Dc (cm^2/s)'][binSel]).mean(axis = 0))
-            dfO.loc[i, 'Dc geoSTD'] = np.exp(np.log(df['Dc (cm^2/s)'][binSel]).std(axis = 0))
-            dfO.loc[i, 'Dt* (cm^2/s)'] = np.exp(np.log(df['Dt* (cm^2/s)'][binSel]).mean(axis = 0))
-            dfO.loc[i, 'Dt* geoSTD'] = np.exp(np.log(df['Dt* (cm^2/s)'][binSel]).std(axis = 0))
-            dfO.loc[i, 'Rfit (Ohm)'] = np.exp(np.log(df['Rfit (Ohm)'][ibinSel]).mean(axis = 0))
-            dfO.loc[i, 'Rfit geoSTD'] = np.exp(np.log(df['Rfit (Ohm)'][ibinSel]).std(axis = 0))
-            dfO.loc[i, 'micR (Ohmcm^2)'] = np.exp(np.log(df['micR (Ohmcm^2)'][ibinSel]).mean(axis = 0))
-            dfO.loc[i, 'micR geoSTD'] = np.exp(np.log(df['micR (Ohmcm^2)'][ibinSel]).std(axis = 0))
-            dfO.loc[i, 'Rdrop (Ohm)'] = np.exp(np.log(df['Rdrop (Ohm)'][ibinSel]).mean(axis = 0))
-            dfO.loc[i, 'Rdrop geoSTD'] = np.exp(np.log(df['Rdrop (Ohm)'][ibinSel]).std(axis = 0))
-            dfOD.loc[i, 'Dc (cm^2/s)'] = np.exp(np.log(dfD['Dc (cm^2/s)'][binSelD]).mean(axis = 0))
-            dfOD.loc[i, 'Dc geoSTD'] = np.exp(np.log(dfD['Dc (cm^2/s)'][binSelD]).std(axis = 0))
-            dfOD.loc[i, 'Dt* (cm^2/s)'] = np.exp(np.log(dfD['Dt* (cm^2/s)'][binSelD]).mean(axis = 0))
-            dfOD.loc[i, 'Dt* geoSTD'] = np.exp(np.log(dfD['Dt* (cm^2/s)'][binSelD]).std(axis = 0))
-            dfOD.loc[i, 'Rfit (Ohm)'] = np.exp(np.log(dfD['Rfit (Ohm)'][ibinSelD]).mean(axis = 0))
-            dfOD.loc[i, 'Rfit geoSTD'] = np.exp(np.log(dfD['Rfit (Ohm)'][ibinSelD]).std(axis = 0))
-            dfOD.loc[i, 'micR (Ohmcm^2)'] = np.exp(np.log(dfD['micR (Ohmcm^2)'][ibinSelD]).mean(axis = 0))
-            dfOD.loc[i, 'micR geoSTD'] = np.exp(np.log(dfD['micR (Ohmcm^2)'][ibinSelD]).std(axis = 0))
-            dfOD.loc[i, 'Rdrop (Ohm)'] = np.exp(np.log(dfD['Rdrop (Ohm)'][ibinSelD]).mean(axis = 0))
-            dfOD.loc[i, 'Rdrop geoSTD'] = np.exp(np.log(dfD['Rdrop (Ohm)'][ibinSelD]).std(axis = 0))
-            dfOC.loc[i, 'Dc (cm^2/s)'] = np.exp(np.log(dfC['Dc (cm^2/s)'][binSelC]).mean(axis = 0))
-            dfOC.loc[i, 'Dc geoSTD'] = np.exp(np.log(dfC['Dc (cm^2/s)'][binSelC]).std(axis = 0))
-            dfOC.loc[i, 'Dt* (cm^2/s)'] = np.exp(np.log(dfC['Dt* (cm^2/s)'][binSelC]).mean(axis = 0))
-            dfOC.loc[i, 'Dt* geoSTD'] = np.exp(np.log(dfC['Dt* (cm^2/s)'][binSelC]).std(axis = 0))
-            dfOC.loc[i, 'Rfit (Ohm)'] = np.exp(np.log(dfC['Rfit (Ohm)'][ibinSelC]).mean(axis = 0))
-            dfOC.loc[i, 'Rfit geoSTD'] = np.exp(np.log(dfC['Rfit (Ohm)'][ibinSelC]).std(axis = 0))
-            dfOC.loc[i, 'micR (Ohmcm^2)'] = np.exp(np.log(dfC['micR (Ohmcm^2)'][ibinSelC]).mean(axis = 0))
-            dfOC.loc[i, 'micR geoSTD'] = np.exp(np.log(dfC['micR (Ohmcm^2)'][ibinSelC]).std(axis = 0))
-            dfOC.loc[i, 'Rdrop (Ohm)'] = np.exp(np.log(dfC['Rdrop (Ohm)'][ibinSelC]).mean(axis = 0))
-            dfOC.loc[i, 'Rdrop geoSTD'] = np.exp(np.log(dfC['Rdrop (Ohm)'][ibinSelC]).std(axis = 0))
-            
-            # Calculate arithmetic mean and standard deviation for all else
-            dfO.loc[i, 'Voltage STD'] = df['Voltage (V)'][binSel|ibinSel].std(axis = 0)
-            dfO.loc[i, 'SOC'] = df['SOC'][binSel|ibinSel].mean(axis = 0)
-            dfO.loc[i, 'SOC STD'] = df['SOC'][binSel|ibinSel].std(axis = 0)
-            dfO.loc[i, 'dq/dV (mAh/gV)'] = df['dq/dV (mAh/gV)'][binSel].mean(axis = 0)
-            dfO.loc[i, 'dq/dV STD'] = df['dq/dV (mAh/gV)'][binSel].std(axis = 0)
-            dfO.loc[i, 'Cap Span'] = df['Cap Span'][binSel].mean(axis = 0)
-            dfO.loc[i, 'Cap Span STD'] = df['Cap Span'][binSel].std(axis = 0)
-            dfO.loc[i, 'Fit Error'] = df['Fit Error'][binSel].mean(axis = 0)
-            dfO.loc[i, 'Fit Error STD'] = df['Fit Error'][binSel].std(axis = 0)
-            dfOD.loc[i, 'Voltage STD'] = dfD['Voltage (V)'][binSelD|ibinSelD].std(axis = 0)
-            dfOD.loc[i, 'SOC'] = dfD['SOC'][binSelD|ibinSelD].mean(axis = 0)
-            dfOD.loc[i, 'SOC STD'] = dfD['SOC'][binSelD|ibinSelD].std(axis = 0)
-            dfOD.loc[i, 'dq/dV (mAh/gV)'] = dfD['dq/dV (mAh/gV)'][binSelD].mean(axis = 0)
-            dfOD.loc[i, 'dq/dV STD'] = dfD['dq/dV (mAh/gV)'][binSelD].std(axis = 0)
-            dfOD.loc[i, 'Cap Span'] = dfD['Cap Span'][binSelD].mean(axis = 0)
-            dfOD.loc[i, 'Cap Span STD'] = dfD['Cap Span'][binSelD].std(axis = 0)
-            dfOD.loc[i, 'Fit Error'] = dfD['Fit Error'][binSelD].mean(axis = 0)
-            dfOD.loc[i, 'Fit Error STD'] = dfD['Fit Error'][binSelD].std(axis = 0)
-            dfOC.loc[i, 'Voltage STD'] = dfC['Voltage (V)'][binSelC|ibinSelC].std(axis = 0)
-            dfOC.loc[i, 'SOC'] = dfC['SOC'][binSelC|ibinSelC].mean(axis = 0)
-            dfOC.loc[i, 'SOC STD'] = dfC['SOC'][binSelC|ibinSelC].std(axis = 0)
-            dfOC.loc[i, 'dq/dV (mAh/gV)'] = dfC['dq/dV (mAh/gV)'][binSelC].mean(axis = 0)
-            dfOC.loc[i, 'dq/dV STD'] = dfC['dq/dV (mAh/gV)'][binSelC].std(axis = 0)
-            dfOC.loc[i, 'Cap Span'] = dfC['Cap Span'][binSelC].mean(axis = 0)
-            dfOC.loc[i, 'Cap Span STD'] = dfC['Cap Span'][binSelC].std(axis = 0)
-            dfOC.loc[i, 'Fit Error'] = dfC['Fit Error'][binSelC].mean(axis = 0)
-            dfOC.loc[i, 'Fit Error STD'] = dfC['Fit Error'][binSelC].std(axis = 0)
+        dfO = _bin_stats(df, centers, binsize)
+        dfOD = _bin_stats(dfD, centers, binsize)
+        dfOC = _bin_stats(dfC, centers, binsize)
             
         # Plot bin averaged charge and discharge
-        fig, axs = plt.subplots(ncols = 2, nrows = 3, figsize = (6, 7.5), sharex = 'col', sharey = 'row',
-        gridspec_kw = {'height_ratios': [2, 2, 1], 'hspace': 0.0, 'width_ratios': [1, 1], 'wspace': 0.0})
-        
-        axs[0, 1].semilogy([], [], 'r-', label = 'Dch $D_{c}$')
-        axs[0, 1].semilogy([], [], 'b-', label = 'Ch $D_{c}$')
-        axs[0, 1].semilogy([], [], 'r:', label = 'Dch $D_{t}^{*}$')
-        axs[0, 1].semilogy([], [], 'b:', label = 'Ch $D_{t}^{*}$')
-        axs[0, 1].legend(frameon = True, ncol = 2)
-        
-        axs[1, 1].semilogy([], [], 'r-', label = 'Dch')
-        axs[1, 1].semilogy([], [], 'b-', label = 'Ch')
-        axs[1, 1].legend(frameon = True)
-        
-        yerrDDc = [dfOD['Dc (cm^2/s)']*(1 - 1/dfOD['Dc geoSTD']), dfOD['Dc (cm^2/s)']*(dfOD['Dc geoSTD'] - 1)]
-        yerrDDt = [dfOD['Dt* (cm^2/s)']*(1 - 1/dfOD['Dt* geoSTD']), dfOD['Dt* (cm^2/s)']*(dfOD['Dt* geoSTD'] - 1)]
-        axs[0, 0].errorbar(dfOD['Voltage (V)'], dfOD['Dc (cm^2/s)'], yerr = yerrDDc, fmt = 'r-')
-        axs[0, 0].errorbar(dfOD['Voltage (V)'], dfOD['Dt* (cm^2/s)'], yerr = yerrDDt, fmt = 'r:', elinewidth = 0.5, markeredgewidth = 0.5)
-        axs[0, 1].errorbar(dfOD['SOC'], dfOD['Dc (cm^2/s)'], yerr = yerrDDc, fmt = 'r-')
-        axs[0, 1].errorbar(dfOD['SOC'], dfOD['Dt* (cm^2/s)'], yerr = yerrDDt, fmt = 'r:', elinewidth = 0.5, markeredgewidth = 0.5)
-        yerrDmicR = [dfOD['micR (Ohmcm^2)']*(1 - 1/dfOD['micR geoSTD']), dfOD['micR (Ohmcm^2)']*(dfOD['micR geoSTD'] - 1)]
-        axs[1, 0].errorbar(dfOD['Voltage (V)'], dfOD['micR (Ohmcm^2)'], yerr = yerrDmicR, fmt = 'r-')
-        axs[1, 1].errorbar(dfOD['SOC'], dfOD['micR (Ohmcm^2)'], yerr = yerrDmicR, fmt = 'r-')
-        axs[2, 0].errorbar(dfOD['Voltage (V)'], dfOD['dq/dV (mAh/gV)'], yerr = dfOD['dq/dV STD'], fmt = 'r-')
-        axs[2, 1].errorbar(dfOD['SOC'], dfOD['dq/dV (mAh/gV)'], yerr = dfOD['dq/dV STD'], fmt = 'r-')
-        
-        yerrCDc = [dfOC['Dc (cm^2/s)']*(1 - 1/dfOC['Dc geoSTD']), dfOC['Dc (cm^2/s)']*(dfOC['Dc geoSTD'] - 1)]
-        yerrCDt = [dfOC['Dt* (cm^2/s)']*(1 - 1/dfOC['Dt* geoSTD']), dfOC['Dt* (cm^2/s)']*(dfOC['Dt* geoSTD'] - 1)]
-        axs[0, 0].errorbar(dfOC['Voltage (V)'], dfOC['Dc (cm^2/s)'], yerr = yerrCDc, fmt = 'b-')
-        axs[0, 0].errorbar(dfOC['Voltage (V)'], dfOC['Dt* (cm^2/s)'], yerr = yerrCDt, fmt = 'b:', elinewidth = 0.5, markeredgewidth = 0.5)
-        axs[0, 1].errorbar(dfOC['SOC'], dfOC['Dc (cm^2/s)'], yerr = yerrCDc, fmt = 'b-')
-        axs[0, 1].errorbar(dfOC['SOC'], dfOC['Dt* (cm^2/s)'], yerr = yerrCDt, fmt = 'b:', elinewidth = 0.5, markeredgewidth = 0.5)
-        yerrCmicR = [dfOC['micR (Ohmcm^2)']*(1 - 1/dfOC['micR geoSTD']), dfOC['micR (Ohmcm^2)']*(dfOC['micR geoSTD'] - 1)]
-        axs[1, 0].errorbar(dfOC['Voltage (V)'], dfOC['micR (Ohmcm^2)'],  yerr = yerrCmicR, fmt = 'b-')
-        axs[1, 1].errorbar(dfOC['SOC'], dfOC['micR (Ohmcm^2)'], yerr = yerrCmicR, fmt = 'b-')
-        axs[2, 0].errorbar(dfOC['Voltage (V)'], dfOC['dq/dV (mAh/gV)'], yerr = dfOC['dq/dV STD'], fmt = 'b-')
-        axs[2, 1].errorbar(dfOC['SOC'], dfOC['dq/dV (mAh/gV)'], yerr = dfOC['dq/dV STD'], fmt = 'b-')
-        
-        axs[0, 0].set_ylabel('$D$ (cm$\mathregular{^{2}}$ s$\mathregular{^{-1}}$)')
-        axs[1, 0].set_ylabel('Max $ρ_{c}$ (Ω cm$\mathregular{^{2}}$)')
-        axs[2, 0].set_ylabel('$dq/dV$\n(mAh g$\mathregular{^{-1}}$ V$\mathregular{^{-1}}$)')
-        axs[2, 0].set_xlabel('Voltage (V)')
-        axs[2, 1].set_xlabel('Ion Saturation')
-        
-        axs[0, 1].invert_xaxis()
-        
-        axs[0, 0].xaxis.set_minor_locator(ticker.AutoMinorLocator())
-        axs[0, 0].yaxis.set_minor_locator(ticker.LogLocator(subs = np.arange(1.0, 10.0) * 0.1, numticks = 10))
-        axs[0, 0].yaxis.set_major_locator(ticker.LogLocator(numticks = 10))
-        axs[0, 1].xaxis.set_minor_locator(ticker.AutoMinorLocator())
-        axs[1, 0].yaxis.set_minor_locator(ticker.LogLocator(subs = np.arange(1.0, 10.0) * 0.1, numticks = 10))
-        axs[1, 0].yaxis.set_major_locator(ticker.LogLocator(numticks = 10))
-        axs[2, 0].yaxis.set_minor_locator(ticker.AutoMinorLocator())
+        fig, axs = _binned_figure()
         
-        axs[0, 0].grid(which = 'minor', color = 'lightgrey')
-        axs[0, 1].grid(which = 'minor', color = 'lightgrey')
-        axs[1, 0].grid(which = 'minor', color = 'lightgrey')
-        axs[1, 1].grid(which = 'minor', color = 'lightgrey')
-        axs[2, 0].grid(which = 'minor', color = 'lightgrey')
-        axs[2, 1].grid(which = 'minor', color = 'lightgrey')
+        axs[0, 1].legend(handles = [Line2D([], [], color = 'r', label = 'Dch $D_{c}$'),
+                                    Line2D([], [], color = 'b', label = 'Ch $D_{c}$'),
+                                    Line2D([], [], color = 'r', linestyle = ':', label = 'Dch $D_{t}^{*}$'),
+                                    Line2D([], [], color = 'b', linestyle = ':', label = 'Ch $D_{t}^{*}$')], frameon = True, ncol = 2)
+        
+        axs[1, 1].legend(handles = [Line2D([], [], color = 'r', label = 'Dch'),
+                                    Line2D([], [], color = 'b', label = 'Ch')], frameon = True)
+        
+        _errorbar_binned(axs, dfOD, 'r')
+        _errorbar_binned(axs, dfOC, 'b')
         
         if export_fig:
             figname = folder / '{0}{1}{2} Ch vs Dch.jpg'.format(matname, plabel, flabel)
             print(figname)
-            plt.savefig(figname, bbox_inches = 'tight')
+            fig.savefig(figname, bbox_inches = 'tight')
             
-        plt.show()
-        plt.close()
+        if show_fig:
+            plt.show()
+        plt.close(fig)
         print()
         
         # Plot bin averaged all
-        fig, axs = plt.subplots(ncols = 2, nrows = 3, figsize = (6, 7.5), sharex = 'col', sharey = 'row',
-        gridspec_kw = {'height_ratios': [2, 2, 1], 'hspace': 0.0, 'width_ratios': [1, 1], 'wspace': 0.0})
-        
-        axs[0, 1].semilogy([], [], 'k-', label = '$D_{c}$')
-        axs[0, 1].semilogy([], [], 'k:', label = '$D_{t}^{*}$')
-        axs[0, 1].legend(frameon = True, ncol = 2)
-        
-        axs[1, 0].semilogy([], [])
-        
-        yerrDc = [dfO['Dc (cm^2/s)']*(1 - 1/dfO['Dc geoSTD']), dfO['Dc (cm^2/s)']*(dfO['Dc geoSTD'] - 1)]
-        yerrDt = [dfO['Dt* (cm^2/s)']*(1 - 1/dfO['Dt* geoSTD']), dfO['Dt* (cm^2/s)']*(dfO['Dt* geoSTD'] - 1)]
-        axs[0, 0].errorbar(dfO['Voltage (V)'], dfO['Dc (cm^2/s)'], yerr = yerrDc, fmt = 'k-')
-        axs[0, 0].errorbar(dfO['Voltage (V)'], dfO['Dt* (cm^2/s)'], yerr = yerrDt, fmt = 'k:', elinewidth = 0.5, markeredgewidth = 0.5)
-        axs[0, 1].errorbar(dfO['SOC'], dfO['Dc (cm^2/s)'], yerr = yerrDc, fmt = 'k-')
-        axs[0, 1].errorbar(dfO['SOC'], dfO['Dt* (cm^2/s)'], yerr = yerrDt, fmt = 'k:', elinewidth = 0.5, markeredgewidth = 0.5)
-        yerrmicR = [dfO['micR (Ohmcm^2)']*(1 - 1/dfO['micR geoSTD']), dfO['micR (Ohmcm^2)']*(dfO['micR geoSTD'] - 1)]
-        axs[1, 0].errorbar(dfO['Voltage (V)'], dfO['micR (Ohmcm^2)'], yerr = yerrmicR, fmt = 'k-')
-        axs[1, 1].errorbar(dfO['SOC'], dfO['micR (Ohmcm^2)'], yerr = yerrmicR, fmt = 'k-')
-        axs[2, 0].errorbar(dfO['Voltage (V)'], dfO['dq/dV (mAh/gV)'], yerr = dfO['dq/dV STD'], fmt = 'k-')
-        axs[2, 1].errorbar(dfO['SOC'], dfO['dq/dV (mAh/gV)'], yerr = dfO['dq/dV STD'], fmt = 'k-')
-        
-        axs[0, 0].set_ylabel('$D$ (cm$\mathregular{^{2}}$ s$\mathregular{^{-1}}$)')
-        axs[1, 0].set_ylabel('Max $ρ_{c}$ (Ω cm$\mathregular{^{2}}$)')
-        axs[2, 0].set_ylabel('$dq/dV$\n(mAh g$\mathregular{^{-1}}$ V$\mathregular{^{-1}}$)')
-        axs[2, 0].set_xlabel('Voltage (V)')
-        axs[2, 1].set_xlabel('Ion Saturation')
-        
-        axs[0, 1].invert_xaxis()
-        
-        axs[0, 0].xaxis.set_minor_locator(ticker.AutoMinorLocator())
-        axs[0, 0].yaxis.set_minor_locator(ticker.LogLocator(subs = np.arange(1.0, 10.0) * 0.1, numticks = 10))
-        axs[0, 0].yaxis.set_major_locator(ticker.LogLocator(numticks = 10))
-        axs[0, 1].xaxis.set_minor_locator(ticker.AutoMinorLocator())
-        axs[1, 0].yaxis.set_minor_locator(ticker.LogLocator(subs = np.arange(1.0, 10.0) * 0.1, numticks = 10))
-        axs[1, 0].yaxis.set_major_locator(ticker.LogLocator(numticks = 10))
-        axs[2, 0].yaxis.set_minor_locator(ticker.AutoMinorLocator())
-
-        axs[0, 0].grid(which = 'minor', color = 'lightgrey')
-        axs[0, 1].grid(which = 'minor', color = 'lightgrey')
-        axs[1, 0].grid(which = 'minor', color = 'lightgrey')
-        axs[1, 1].grid(which = 'minor', color = 'lightgrey')  
-        axs[2, 0].grid(which = 'minor', color = 'lightgrey')
-        axs[2, 1].grid(which = 'minor', color = 'lightgrey')  
+        fig, axs = _binned_figure()
+        
+        axs[0, 1].legend(handles = [Line2D([], [], color = 'k', label = '$D_{c}$'),
+                                    Line2D([], [], color = 'k', linestyle = ':', label = '$D_{t}^{*}$')], frameon = True, ncol = 2)
+        
+        _errorbar_binned(axs, dfO, 'k')
         
         if export_fig:
             figname = folder / '{0}{1}{2} All.jpg'.format(matname, plabel, flabel)
             print(figname)
-            plt.savefig(figname, bbox_inches = 'tight')
+            fig.savefig(figname, bbox_inches = 'tight')
             
-        plt.show()
-        plt.close()
+        if show_fig:
+            plt.show()
+        plt.close(fig)
         print()
         
         # Create data files
         if export_data:
-            dfO = dfO[['Voltage (V)', 'Voltage STD', 'SOC', 'SOC STD', 'Dc (cm^2/s)', 'Dc geoSTD', 'Dt* (cm^2/s)', 'Dt* geoSTD', 'dq/dV (mAh/gV)', 'dq/dV STD', \
-                   'Rfit (Ohm)', 'Rfit geoSTD', 'micR (Ohmcm^2)', 'micR geoSTD', 'Rdrop (Ohm)', 'Rdrop geoSTD', 'Cap Span', 'Cap Span STD', 'Fit Error', 'Fit Error STD']]
-            dfOD = dfOD[['Voltage (V)', 'Voltage STD', 'SOC', 'SOC STD', 'Dc (cm^2/s)', 'Dc geoSTD', 'Dt* (cm^2/s)', 'Dt* geoSTD', 'dq/dV (mAh/gV)', 'dq/dV STD', \
-                     'Rfit (Ohm)', 'Rfit geoSTD', 'micR (Ohmcm^2)', 'micR geoSTD', 'Rdrop (Ohm)', 'Rdrop geoSTD', 'Cap Span', 'Cap Span STD', 'Fit Error', 'Fit Error STD']]
-            dfOC = dfOC[['Voltage (V)', 'Voltage STD', 'SOC', 'SOC STD', 'Dc (cm^2/s)', 'Dc geoSTD', 'Dt* (cm^2/s)', 'Dt* geoSTD', 'dq/dV (mAh/gV)', 'dq/dV STD', \
-                     'Rfit (Ohm)', 'Rfit geoSTD', 'micR (Ohmcm^2)', 'micR geoSTD', 'Rdrop (Ohm)', 'Rdrop geoSTD', 'Cap Span', 'Cap Span STD', 'Fit Error', 'Fit Error STD']]
-            
             filepath = folder / '{0}{1}{2} ({3}).xlsx'.format(matname, plabel, flabel, ', '.join(cells))
             
             print("Bin averaged data exporting to:\n" + str(filepath) + "\n")
             
-            writer = pd.ExcelWriter(filepath)
-            dfO.to_excel(writer, sheet_name = 'All', index = False)
-            dfOD.to_excel(writer, sheet_name = 'Discharge', index = False)
-            dfOC.to_excel(writer, sheet_name = 'Charge', index = False)
-            writer.save()
-            writer.close()
+            sheets = [(name, frame[BINNEDEXPORT]) for name, frame in [('All', dfO), ('Discharge', dfOD), ('Charge', dfOC)]]
+            _write_sheets(filepath, sheets)
+            # The parquet copy holds the same 'All' frame, non-finite values included
+            if PARQUET:
+                sheets[0][1].to_parquet(filepath.with_suffix('.parquet'), engine = 'pyarrow', index = False)
             
 class MATCOMPARE():
     
-    def __init__(self, path, mats, export_data = None, export_fig = True):
+    def __init__(self, path, mats, export_data = None, export_fig = True, show_fig = True):
         
         print("_________________________________")
         
@@ -2219,74 +2159,47 @@ class MATCOMPARE():
         folder = Path(path)
         
         # Generate plot for individual cells
-        fig, axs = plt.subplots(ncols = 2, nrows = 3, figsize = (6, 7.5), sharex = 'col', sharey = 'row',
-        gridspec_kw = {'height_ratios': [2, 2, 1], 'hspace': 0.0, 'width_ratios': [1, 1], 'wspace': 0.0})
+        fig, axs = _binned_figure()
                 
-        axs[0, 1].semilogy([], [], 'k-', label = '$D_{c}$')
-        axs[0, 1].semilogy([], [], 'k:', label = '$D_{t}^{*}$')
-        axs[0, 1].legend(frameon = True, ncol = 2)
-        
-        axs[0, 0].set_ylabel('$D$ (cm$\mathregular{^{2}}$ s$\mathregular{^{-1}}$)')
-        axs[1, 0].set_ylabel('Max $ρ_{c}$ (Ω cm$\mathregular{^{2}}$)')
-        axs[2, 0].set_ylabel('$dq/dV$\n(mAh g$\mathregular{^{-1}}$ V$\mathregular{^{-1}}$)')
-        axs[2, 0].set_xlabel('Voltage (V)')
-        axs[2, 1].set_xlabel('Ion Saturation')
-        
-        axs[0, 1].invert_xaxis()
-        
-        axs[0, 0].xaxis.set_minor_locator(ticker.AutoMinorLocator())
-        axs[0, 0].yaxis.set_minor_locator(ticker.LogLocator(subs = np.arange(1.0, 10.0) * 0.1, numticks = 10))
-        axs[0, 0].yaxis.set_major_locator(ticker.LogLocator(numticks = 10))
-        axs[0, 1].xaxis.set_minor_locator(ticker.AutoMinorLocator())
-        axs[1, 0].yaxis.set_minor_locator(ticker.LogLocator(subs = np.arange(1.0, 10.0) * 0.1, numticks = 10))
-        axs[1, 0].yaxis.set_major_locator(ticker.LogLocator(numticks = 10))
-        axs[2, 0].yaxis.set_minor_locator(ticker.AutoMinorLocator())
-
-        axs[0, 0].grid(which = 'minor', color = 'lightgrey')
-        axs[0, 1].grid(which = 'minor', color = 'lightgrey')
-        axs[1, 0].grid(which = 'minor', color = 'lightgrey')
-        axs[1, 1].grid(which = 'minor', color = 'lightgrey') 
-        axs[2, 0].grid(which = 'minor', color = 'lightgrey')
-        axs[2, 1].grid(which = 'minor', color = 'lightgrey') 
+        axs[0, 1].legend(handles = [Line2D([], [], color = 'k', label = '$D_{c}$'),
+                                    Line2D([], [], color = 'k', linestyle = ':', label = '$D_{t}^{*}$')], frameon = True, ncol = 2)
         
         colors = ['r', 'magenta', 'b', 'k']
         
         # Find and read file data into dataframes
         i = 0
+        handles = []
         for mat in mats:
+            if i > 3:
+                break
             matpath = folder / mat
-            for filepath in matpath.iterdir():
-                if mat + ' (' in str(filepath):
-                    if i > 3:
-                        break
-                    
-                    print("Found data for {}".format(Path(filepath).name))
-                    df = pd.read_excel(filepath, sheet_name = 'All')
-                    
-                    # Plot dataframe
-                    yerrDc = [df['Dc (cm^2/s)']*(1 - 1/df['Dc geoSTD']), df['Dc (cm^2/s)']*(df['Dc geoSTD'] - 1)]
-                    yerrDt = [df['Dt* (cm^2/s)']*(1 - 1/df['Dt* geoSTD']), df['Dt* (cm^2/s)']*(df['Dt* geoSTD'] - 1)]
-                    axs[0, 0].errorbar(df['Voltage (V)'], df['Dc (cm^2/s)'], yerr = yerrDc, fmt = '-', color = colors[i])
-                    axs[0, 0].errorbar(df['Voltage (V)'], df['Dt* (cm^2/s)'], yerr = yerrDt, fmt = ':', color = colors[i], elinewidth = 0.5, markeredgewidth = 0.5)
-                    axs[0, 1].errorbar(df['SOC'], df['Dc (cm^2/s)'], yerr = yerrDc, fmt = '-', color = colors[i])
-                    axs[0, 1].errorbar(df['SOC'], df['Dt* (cm^2/s)'], yerr = yerrDt, fmt = ':', color = colors[i], elinewidth = 0.5, markeredgewidth = 0.5)
-                    yerrmicR = [df['micR (Ohmcm^2)']*(1 - 1/df['micR geoSTD']), df['micR (Ohmcm^2)']*(df['micR geoSTD'] - 1)]
-                    axs[1, 0].errorbar(df['Voltage (V)'], df['micR (Ohmcm^2)'], yerr = yerrmicR, color = colors[i], fmt = '-')
-                    axs[1, 1].errorbar(df['SOC'], df['micR (Ohmcm^2)'], yerr = yerrmicR, fmt = '-', color = colors[i])
-                    axs[1, 1].semilogy([], [], color = colors[i], label = mat)
-                    axs[2, 0].errorbar(df['Voltage (V)'], df['dq/dV (mAh/gV)'], yerr = df['dq/dV STD'], color = colors[i], fmt = '-')
-                    axs[2, 1].errorbar(df['SOC'], df['dq/dV (mAh/gV)'], yerr = df['dq/dV STD'], fmt = '-', color = colors[i])
-                    
-                    i = i + 1
+            for filepath in matpath.glob(glob.escape(mat) + ' (*).xlsx'):
+                if i > 3:
+                    break
+                
+                print("Found data for {}".format(filepath.name))
+                # Read the parquet copy of the 'All' sheet unless the workbook has been modified since it was written
+                sidecar = filepath.with_suffix('.parquet')
+                if PARQUET and sidecar.is_file() and sidecar.stat().st_mtime_ns >= filepath.stat().st_mtime_ns:
+                    df = pd.read_parquet(sidecar, engine = 'pyarrow', columns = BINNEDCOLUMNS)
+                else:
+                    df = pd.read_excel(filepath, sheet_name = 'All', usecols = BINNEDCOLUMNS)
+                
+                # Plot dataframe
+                _errorbar_binned(axs, df, colors[i])
+                handles.append(Line2D([], [], color = colors[i], label = mat))
+                
+                i = i + 1
                     
-        axs[1, 1].legend(frameon = True)            
+        axs[1, 1].legend(handles = handles, frameon = True)            
         print()
         
         if export_fig:
             figname = folder / 'Material Comparison ({0}).jpg'.format(', '.join(mats))
             print(figname)
-            plt.savefig(figname, bbox_inches = 'tight')
+            fig.savefig(figname, bbox_inches = 'tight')
             
-        plt.show()
-        plt.close()
+        if show_fig:
+            plt.show()
+        plt.close(fig)
         print()
\ No newline at end of file